@@ -0,0 +1,685 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Alignment matrix cache and writers utilized by F2P.py. Requires numpy.
+# }}}
+
+
+# {{{ Imports
+from abc import ABCMeta, abstractmethod
+from os import rename
+from os.path import exists
+import re
+import numpy as np
+from FastaIO import FastaIndex, file_stamp, write_stamp, stamp_is_current
+# }}}
+
+
+# {{{ Globals
+# Names which need not be quoted in nexus output
+NEXUS_WORD = re.compile(r'^[A-Za-z0-9_.]+$')
+# Offset basis and prime of the 64-bit FNV-1a hash of each column (see
+# site_patterns)
+FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+FNV_PRIME = np.uint64(0x100000001b3)
+# Whether each character is a nucleotide, ambiguity code, gap or missing
+# character
+NUCLEOTIDES = np.zeros(256, dtype=bool)
+for i in 'ACGTURYKMSWBDHVN-?.':
+    NUCLEOTIDES[ord(i)] = NUCLEOTIDES[ord(i.lower())] = True
+# Maximum number of rows, evenly spaced throughout the alignment, of which
+# the characters are examined by guess_datatype
+GUESS_ROWS = 100
+# }}}
+
+
+# {{{ AlignmentMatrix
+class AlignmentMatrix(object):
+
+    """ {{{ Docstrings
+
+    A class in which an alignment is stored as a compact matrix of
+    characters, with one row per taxon, i.e.
+
+        matrix[taxon, column] = ord(character)
+
+    The alignment is parsed only once, into a numpy (".npy") file and an ID
+    table (".ids") file, one ID per line, alongside the fasta file. Both are
+    reused thereafter, unless the fasta file differs from that recorded in
+    their stamp (".npy.stamp"; see FastaIO.stamp_is_current), the matrix
+    being memory mapped rather than read into memory.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, fasta_file):
+        self._path = fasta_file
+        self._matrix_file = fasta_file + '.npy'
+        self._ids_file = fasta_file + '.ids'
+        self._stamp_file = self._matrix_file + '.stamp'
+        if not self.cache_is_current():
+            self.build_cache()
+        self.ids = self.read_ids()
+        self.matrix = np.load(self._matrix_file, mmap_mode='r')
+        # Number of taxa and characters in alignment
+        self.ntax, self.nchar = self.matrix.shape
+    # }}}
+
+    # {{{ cache_is_current
+    def cache_is_current(self):
+
+        """ {{{ Docstrings
+
+        Returns TRUE if both cache files exist and were built from the fasta
+        file as it is now, i.e. it is unchanged since (see
+        FastaIO.stamp_is_current).
+
+        }}} """
+
+        for i in (self._matrix_file, self._ids_file):
+            if not exists(i):
+                return False
+        return stamp_is_current(self._path, self._stamp_file)
+    # }}}
+
+    # {{{ build_cache
+    def build_cache(self):
+
+        """ {{{ Docstrings
+
+        Parses the fasta file into the cache files, streaming one sequence at
+        a time from the fasta index into the memory mapped matrix. Raises
+        ValueError if the sequences are not aligned, i.e. not all of equal
+        length.
+
+        }}} """
+
+        stamp = file_stamp(self._path)
+        index = FastaIndex(self._path)
+        try:
+            if not index.ids:
+                raise ValueError(
+                        '{0} contains no sequences.'.format(self._path)
+                        )
+            lengths = set(index.length(ID) for ID in index.ids)
+            if len(lengths) != 1:
+                raise ValueError(
+                        '{0} is not aligned; sequences are of lengths '
+                        '{1}.'.format(
+                                self._path,
+                                ', '.join(str(i) for i in sorted(lengths))
+                                )
+                        )
+            # Write to temporary files first, such that an interrupted build
+            # never leaves an incomplete cache behind
+            matrix_file = self._matrix_file + '.tmp'
+            matrix = np.lib.format.open_memmap(
+                    matrix_file, mode='w+', dtype=np.uint8,
+                    shape=(len(index.ids), lengths.pop())
+                    )
+            for row, ID in enumerate(index.ids):
+                matrix[row] = np.frombuffer(index.fetch(ID), dtype=np.uint8)
+            matrix.flush()
+            del matrix
+            with open(self._ids_file + '.tmp', 'w') as ids:
+                for ID in index.ids:
+                    ids.write(ID + '\n')
+        finally:
+            index.close()
+        rename(matrix_file, self._matrix_file)
+        rename(self._ids_file + '.tmp', self._ids_file)
+        write_stamp(self._stamp_file, stamp)
+    # }}}
+
+    # {{{ read_ids
+    def read_ids(self):
+
+        """ {{{ Docstrings
+
+        Reads the ID table into a list, in the order of the rows of the
+        matrix.
+
+        }}} """
+
+        with open(self._ids_file, 'r') as ids:
+            return [line.rstrip('\n') for line in ids]
+    # }}}
+
+    # {{{ fetch
+    def fetch(self, row, start=0, end=None):
+
+        """ {{{ Docstrings
+
+        Returns the characters at positions start through end (zero-based,
+        end exclusive, as with python slicing) of the given row, as a string.
+
+        }}} """
+
+        return self.matrix[row, start:end].tobytes()
+    # }}}
+# }}}
+
+
+# {{{ AlignmentWriter
+class AlignmentWriter(object):
+
+    """ {{{ Docstrings
+
+    Base class of all alignment writers. A writer is given the names of all
+    taxa (and the number of characters) upon instantiation, whereupon it
+    writes any header, and is then given consecutive chunks of rows of the
+    alignment matrix, in order, via write_rows. Each chunk is formatted with
+    numpy and written with as few writes as possible. If columns are given,
+    only those columns of each row are written, in the order given.
+
+    Alternatively, writers of sequential formats, in which every line is of
+    the same length, may reserve the lines of every row at once (see
+    reserve), such that the alignment may be written one range of columns at
+    a time rather than one range of rows at a time.
+
+    Subclasses must implement write_rows and prefixes and may override
+    header and footer.
+
+    }}} """
+
+    __metaclass__ = ABCMeta
+
+    # {{{ __init__
+    def __init__(self, path, names, nchar, columns=None):
+        self.path = path
+        self.names = list(names)
+        self.ntax = len(self.names)
+        self.columns = columns
+        self.nchar = nchar if columns is None else len(columns)
+        self._reserved = None
+        self._file = open(path, 'wb')
+        self._file.write(self.header())
+    # }}}
+
+    # {{{ header
+    def header(self):
+        return ''
+    # }}}
+
+    # {{{ footer
+    def footer(self):
+        return ''
+    # }}}
+
+    # {{{ write_rows
+    @abstractmethod
+    def write_rows(self, first, rows):
+
+        """ {{{ Docstrings
+
+        Writes a chunk of rows of the alignment matrix, i.e. a matrix of
+        characters with one row per taxon, beginning with taxon first (an
+        index of names) and consisting of nchar columns. Chunks are given in
+        order, each beginning where the previous ended.
+
+        }}} """
+    # }}}
+
+    # {{{ prefixes
+    @abstractmethod
+    def prefixes(self):
+
+        """ {{{ Docstrings
+
+        Returns the characters preceding the sequence of each row within
+        sequential output (e.g. the padded name thereof), as a matrix of
+        characters with one row per taxon, every row being of the same
+        length. Writers of formats in which rows are not of a fixed layout,
+        and so cannot be reserved, raise ValueError.
+
+        }}} """
+    # }}}
+
+    # {{{ reserve
+    def reserve(self, fill='-'):
+
+        """ {{{ Docstrings
+
+        Reserves the lines of every row, i.e. the prefix of each row (see
+        prefixes) followed by nchar fill characters and a newline character,
+        memory mapping them. Returns the memory mapped matrix of the
+        characters of every row, which may then be written in any order
+        prior to close.
+
+        }}} """
+
+        prefixes = self.prefixes()
+        width = prefixes.shape[1] + self.nchar + 1
+        offset = self._file.tell()
+        self._file.truncate(offset + width * self.ntax)
+        self._file.flush()
+        self._reserved = np.memmap(
+                self.path, dtype=np.uint8, mode='r+', offset=offset,
+                shape=(self.ntax, width)
+                )
+        self._reserved[:, :prefixes.shape[1]] = prefixes
+        self._reserved[:, prefixes.shape[1]:-1] = ord(fill)
+        self._reserved[:, -1] = ord('\n')
+        return self._reserved[:, prefixes.shape[1]:-1]
+    # }}}
+
+    # {{{ close
+    def close(self):
+        if self._reserved is not None:
+            self._reserved.flush()
+            self._reserved = None
+        self._file.seek(0, 2)
+        self._file.write(self.footer())
+        self._file.close()
+    # }}}
+
+    # {{{ padded_names
+    def padded_names(self, width):
+
+        """ {{{ Docstrings
+
+        Returns the names of all taxa, left justified to the given width, as
+        a matrix of characters with one row per taxon.
+
+        }}} """
+
+        return np.frombuffer(
+                ''.join(i.ljust(width) for i in self.names), dtype=np.uint8
+                ).reshape(self.ntax, width)
+    # }}}
+
+    # {{{ lines
+    @staticmethod
+    def lines(*columns):
+
+        """ {{{ Docstrings
+
+        Concatenates matrices of characters (or strings, repeated for every
+        row) side by side and terminates each row with a newline character,
+        returning the resulting lines as a string.
+
+        }}} """
+
+        nrows = max(len(i) for i in columns if not isinstance(i, str))
+        columns = [
+                AlignmentWriter.tile(i, nrows) if isinstance(i, str) else i
+                for i in columns + ('\n',)
+                ]
+        return np.hstack(columns).tobytes()
+    # }}}
+
+    # {{{ tile
+    @staticmethod
+    def tile(string, nrows):
+
+        """ {{{ Docstrings
+
+        Returns a matrix of characters in which every one of nrows rows is
+        the given string.
+
+        }}} """
+
+        return np.tile(np.frombuffer(string, dtype=np.uint8), (nrows, 1))
+    # }}}
+# }}}
+
+
+# {{{ PhylipWriter
+class PhylipWriter(AlignmentWriter):
+
+    """ {{{ Docstrings
+
+    A class in which phylip output is stored, in either sequential or
+    interleaved format, preceded by a header of the form:
+
+        ntax nchar\n
+
+    Names are padded to a fixed width followed by a space, i.e. to the 10
+    characters of strict phylip format or, if relaxed, to the length of the
+    longest name. Each interleaved block contains the same range of columns
+    of every taxon, only the first block being preceded by names, and blocks
+    are separated by an empty line. As every line of a block is of the same
+    length, the lines of each chunk of rows are written at their final
+    position within each block, such that interleaved output requires only a
+    single pass over the rows.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(
+            self, path, names, nchar, interleaved=False, relaxed=False,
+            block_width=50, columns=None
+            ):
+        self.interleaved = interleaved
+        self.block_width = block_width
+        longest = max(len(i) for i in names) if names else 0
+        width = longest if relaxed else max(10, longest)
+        AlignmentWriter.__init__(self, path, names, nchar, columns)
+        self._names = self.padded_names(width)
+        # Byte offset at which each block begins and length of each line
+        # thereof
+        self._blocks = []
+        offset = len(self.header())
+        for start in range(0, self.nchar, block_width):
+            line = min(block_width, self.nchar - start) + 1
+            if start == 0:
+                line += width + 1
+            else:
+                # Empty line separating blocks
+                offset += 1
+            self._blocks.append((start, offset, line))
+            offset += line * self.ntax
+    # }}}
+
+    # {{{ header
+    def header(self):
+        return '{0} {1}\n'.format(self.ntax, self.nchar)
+    # }}}
+
+    # {{{ prefixes
+    def prefixes(self):
+        if self.interleaved:
+            raise ValueError('Interleaved phylip does not support reserve.')
+        return np.hstack((self._names, self.tile(' ', self.ntax)))
+    # }}}
+
+    # {{{ write_rows
+    def write_rows(self, first, rows):
+        names = self._names[first:first + len(rows)]
+        if not self.interleaved:
+            self._file.write(self.lines(names, ' ', rows))
+            return
+        for start, offset, line in self._blocks:
+            columns = rows[:, start:start + self.block_width]
+            if start == 0:
+                block = self.lines(names, ' ', columns)
+            else:
+                block = self.lines(columns)
+            if start and first == 0:
+                self._file.seek(offset - 1)
+                block = '\n' + block
+            else:
+                self._file.seek(offset + first * line)
+            self._file.write(block)
+    # }}}
+# }}}
+
+
+# {{{ NexusWriter
+class NexusWriter(AlignmentWriter):
+
+    """ {{{ Docstrings
+
+    A class in which nexus output is stored, i.e. a DATA block containing
+    the alignment in sequential format. Names containing any character other
+    than letters, digits, "_" and "." are quoted. Character sets, if given
+    as (name, first column, last column) tuples (one-based, inclusive), are
+    written to a SETS block following the DATA block.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(
+            self, path, names, nchar, datatype='DNA', columns=None,
+            charsets=()
+            ):
+        self.datatype = datatype
+        self.charsets = list(charsets)
+        names = [quote_nexus(i) for i in names]
+        AlignmentWriter.__init__(self, path, names, nchar, columns)
+        self._names = self.padded_names(max(len(i) for i in names))
+    # }}}
+
+    # {{{ header
+    def header(self):
+        return (
+                '#NEXUS\n\nBEGIN DATA;\n'
+                '\tDIMENSIONS NTAX={0} NCHAR={1};\n'
+                '\tFORMAT DATATYPE={2} MISSING=? GAP=-;\n'
+                'MATRIX\n'
+                ).format(self.ntax, self.nchar, self.datatype)
+    # }}}
+
+    # {{{ footer
+    def footer(self):
+        footer = ';\nEND;\n'
+        if self.charsets:
+            footer += '\nBEGIN SETS;\n{0}END;\n'.format(''.join(
+                    '\tCHARSET {0} = {1}-{2};\n'.format(quote_nexus(i), j, k)
+                    for i, j, k in self.charsets
+                    ))
+        return footer
+    # }}}
+
+    # {{{ prefixes
+    def prefixes(self):
+        return np.hstack((self._names, self.tile('  ', self.ntax)))
+    # }}}
+
+    # {{{ write_rows
+    def write_rows(self, first, rows):
+        names = self._names[first:first + len(rows)]
+        self._file.write(self.lines(names, '  ', rows))
+    # }}}
+# }}}
+
+
+# {{{ FastaWriter
+class FastaWriter(AlignmentWriter):
+
+    """ {{{ Docstrings
+
+    A class in which fasta output is stored, each sequence being wrapped at
+    line_width characters.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, path, names, nchar, line_width=50, columns=None):
+        self.line_width = line_width
+        AlignmentWriter.__init__(self, path, names, nchar, columns)
+    # }}}
+
+    # {{{ prefixes
+    def prefixes(self):
+        raise ValueError('Fasta does not support reserve.')
+    # }}}
+
+    # {{{ write_rows
+    def write_rows(self, first, rows):
+        records = []
+        for name, row in zip(self.names[first:first + len(rows)], rows):
+            records.append('>{0}\n'.format(name))
+            for start in range(0, self.nchar, self.line_width):
+                records.append(row[start:start + self.line_width].tobytes())
+                records.append('\n')
+        self._file.write(''.join(records))
+    # }}}
+# }}}
+
+
+# {{{ quote_nexus
+def quote_nexus(name):
+
+    """ {{{ Docstrings
+
+    Quotes a name for nexus output, if necessary, doubling any single quotes
+    within it.
+
+    }}} """
+
+    if name and NEXUS_WORD.match(name):
+        return name
+    return "'{0}'".format(name.replace("'", "''"))
+# }}}
+
+
+# {{{ guess_datatype
+def guess_datatype(matrix):
+
+    """ {{{ Docstrings
+
+    Guesses the nexus datatype of an alignment matrix, given a sample of at
+    most GUESS_ROWS rows spread evenly throughout it; DNA if every character
+    thereof is a nucleotide (or ambiguity code, gap or missing character),
+    else PROTEIN. A single row may consist entirely of gaps, or of the
+    residues common to both alphabets, and so is not sampled alone.
+
+    }}} """
+
+    rows = np.unique(np.linspace(
+            0, len(matrix) - 1, min(GUESS_ROWS, len(matrix))
+            ).astype(np.intp))
+    if np.all(NUCLEOTIDES[matrix[rows]]):
+        return 'DNA'
+    return 'PROTEIN'
+# }}}
+
+
+# {{{ export_alignment
+def export_alignment(alignment, rows, writers, chunk_size=1000):
+
+    """ {{{ Docstrings
+
+    Exports the given rows of an alignment matrix to any number of writers
+    in a single pass, reading chunk_size rows of the matrix at a time and
+    passing each chunk to every writer before reading the next.
+
+    }}} """
+
+    rows = np.asarray(rows, dtype=np.intp)
+    for first in range(0, len(rows), chunk_size):
+        chunk = alignment.matrix[rows[first:first + chunk_size]]
+        for writer in writers:
+            if writer.columns is None:
+                writer.write_rows(first, chunk)
+            else:
+                writer.write_rows(first, chunk[:, writer.columns])
+    for writer in writers:
+        writer.close()
+# }}}
+
+
+# {{{ site_patterns
+def site_patterns(alignment, rows, chunk_size=1000):
+
+    """ {{{ Docstrings
+
+    Determines the unique site patterns, i.e. distinct columns, of the given
+    rows of an alignment matrix. Returns a numpy array of the first column
+    exhibiting each pattern, in the order in which the patterns occur, and a
+    numpy array of the number of columns exhibiting each pattern.
+
+    Rather than comparing columns, every column is hashed at once (64-bit
+    FNV-1a over its characters), reading chunk_size rows of the matrix at a
+    time, and the hashes are grouped with np.unique. Each column is then
+    compared with the first column of its group, in a second pass, and any
+    column whose hash collided with that of a different pattern is grouped
+    by its characters instead, such that the result is always exact.
+
+    }}} """
+
+    rows = np.asarray(rows, dtype=np.intp)
+    hashes = np.full(alignment.nchar, FNV_OFFSET, dtype=np.uint64)
+    for first in range(0, len(rows), chunk_size):
+        for row in alignment.matrix[rows[first:first + chunk_size]]:
+            hashes ^= row
+            hashes *= FNV_PRIME
+    first_columns, labels = np.unique(
+            hashes, return_index=True, return_inverse=True
+            )[1:]
+    # Verify that every column is identical to the first of its group
+    representatives = first_columns[labels]
+    collided = np.zeros(alignment.nchar, dtype=bool)
+    for first in range(0, len(rows), chunk_size):
+        chunk = alignment.matrix[rows[first:first + chunk_size]]
+        collided |= np.any(chunk != chunk[:, representatives], axis=0)
+    if collided.any():
+        columns = np.flatnonzero(collided)
+        patterns = {}
+        for column, characters in zip(
+                columns, alignment.matrix[rows][:, columns].T
+                ):
+            labels[column] = patterns.setdefault(
+                    characters.tobytes(), len(first_columns) + len(patterns)
+                    )
+    first_columns, counts = np.unique(
+            labels, return_index=True, return_counts=True
+            )[1:]
+    order = np.argsort(first_columns)
+    return(first_columns[order], counts[order])
+# }}}
+
+
+# {{{ locus_partitions
+def locus_partitions(loci):
+
+    """ {{{ Docstrings
+
+    Reads the alignment matrix of each locus (see AlignmentMatrix), given
+    the names of their fasta files, in preparation for concatenating them
+    into a supermatrix. Returns a list of every taxon ID, in the order in
+    which they first occur, and a list of tuples in the form of:
+
+        [(start, end, 'datatype'), (start, end, 'datatype')]
+
+    Where start and end are the zero-based, end exclusive, columns of each
+    locus within the supermatrix. Only the ID tables, dimensions and a sample
+    of the rows of the loci (see guess_datatype) are read. Raises ValueError
+    if any ID occurs more than once within a locus.
+
+    }}} """
+
+    taxa = []
+    # Index of each taxon ID
+    index = {}
+    partitions = []
+    start = 0
+    for locus in loci:
+        alignment = AlignmentMatrix(locus)
+        if len(set(alignment.ids)) != alignment.ntax:
+            raise ValueError(
+                    '{0} contains duplicate sequence IDs.'.format(locus)
+                    )
+        for ID in alignment.ids:
+            if ID not in index:
+                index[ID] = len(taxa)
+                taxa.append(ID)
+        partitions.append((
+                start, start + alignment.nchar,
+                guess_datatype(alignment.matrix)
+                ))
+        start += alignment.nchar
+    return(taxa, partitions)
+# }}}
+
+
+# {{{ fill_supermatrix
+def fill_supermatrix(loci, taxa, partitions, matrices, chunk_size=1000):
+
+    """ {{{ Docstrings
+
+    Copies each locus into its columns of the given supermatrices (e.g.
+    those reserved by AlignmentWriter.reserve), given the taxa and
+    partitions returned by locus_partitions. Only one locus is read at a
+    time, chunk_size rows at a time, and the rows of taxa absent from a
+    locus are left as they are, i.e. filled with gaps.
+
+    }}} """
+
+    index = dict((ID, i) for i, ID in enumerate(taxa))
+    for locus, (start, end, datatype) in zip(loci, partitions):
+        alignment = AlignmentMatrix(locus)
+        rows = np.array([index[ID] for ID in alignment.ids], dtype=np.intp)
+        for first in range(0, alignment.ntax, chunk_size):
+            chunk = alignment.matrix[first:first + chunk_size]
+            for matrix in matrices:
+                matrix[rows[first:first + chunk_size], start:end] = chunk
+# }}}
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Shared batch mode functionality utilized by F2P.py, GO_TPM.py, Pep2Nuc.py,
+# RegEx_Tree.py, Rm_Cont.py and ShK.py.
+# }}}
+
+
+# {{{ Imports
+from os.path import basename, getsize, isfile, splitext
+from multiprocessing import Pool, cpu_count
+from pickle import dumps
+from sys import exit
+from traceback import format_exc
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+# }}}
+
+
+# {{{ Globals
+# ::MODIFIABLE::
+# Size (in bytes) of the input files of a task from which it is considered
+# large
+LARGE_FILE_SIZE = 1 << 30
+# Maximum number of large tasks run at once, irrespective of the number of
+# jobs, such that no more than this many large files are held in memory
+MAX_LARGE_FILES = 2
+# }}}
+
+
+# {{{ file_stem
+def file_stem(file_name, suffixes=()):
+
+    """ {{{ Docstrings
+
+    Returns the stem of a file name, i.e. the name sans final extension and
+    any of the given suffixes. For instance, given the suffixes "_GO" and
+    "_TPM", both "Seq_One_GO.txt" and "Seq_One_TPM.txt" have the stem
+    "Seq_One".
+
+    }}} """
+
+    stem = splitext(basename(file_name))[0]
+    for suffix in suffixes:
+        if suffix and stem.endswith(suffix):
+            return stem[:-len(suffix)]
+    return stem
+# }}}
+
+
+# {{{ file_stems
+def file_stems(file_name, suffixes=()):
+
+    """ {{{ Docstrings
+
+    Generator which yields the stem of a file name (see file_stem), then
+    that of the stem itself, and so on, until no extension remains. For
+    instance, "Seq_One.fasta.transdecoder.pep" yields
+    "Seq_One.fasta.transdecoder", "Seq_One.fasta" and "Seq_One".
+
+    }}} """
+
+    stem = file_stem(file_name, suffixes)
+    yield stem
+    while splitext(stem)[1]:
+        stem = file_stem(stem, suffixes)
+        yield stem
+# }}}
+
+
+# {{{ pair_files
+def pair_files(files, other_files, suffixes=()):
+
+    """ {{{ Docstrings
+
+    Pairs each file with the other file sharing its stem or, failing that,
+    a shorter stem thereof (see file_stems), returning a list of tuples in
+    the form of:
+
+        [('file', 'other_file'), ('file', 'other_file')]
+
+    Ordered by stem. Any number of files may share an other file, e.g. both
+    "Seq_One.fasta.transdecoder.pep" and
+    "Seq_One.fasta.transdecoder_filtered.pep" share "Seq_One.fasta". Files
+    without a counterpart, files sharing their stem with another file of the
+    same kind and other files matching no file are reported and skipped,
+    rather than misaligning every subsequent pair.
+
+    }}} """
+
+    by_stem = []
+    for i in (files, other_files):
+        stems = {}
+        for j in i:
+            stems.setdefault(file_stem(j, suffixes), []).append(j)
+        by_stem.append(stems)
+    pairs = []
+    paired = set()
+    for stem in sorted(by_stem[0]):
+        matches = []
+        for i in file_stems(by_stem[0][stem][0], suffixes):
+            matches = by_stem[1].get(i, [])
+            if matches:
+                break
+        if not matches:
+            print('Skipping {0}; no corresponding file found.'.format(
+                    ', '.join(sorted(by_stem[0][stem]))
+                    ))
+        elif len(by_stem[0][stem]) > 1 or len(matches) > 1:
+            paired.update(matches)
+            print('Skipping {0}; files are named ambiguously.'.format(
+                    ', '.join(sorted(by_stem[0][stem] + matches))
+                    ))
+        else:
+            paired.update(matches)
+            pairs.append((by_stem[0][stem][0], matches[0]))
+    for i in sorted(set(other_files) - paired):
+        print('Skipping {0}; no corresponding file found.'.format(i))
+    return pairs
+# }}}
+
+
+# {{{ task_size
+def task_size(task):
+
+    """ {{{ Docstrings
+
+    Returns the total size (in bytes) of those arguments of a task which are
+    names of files.
+
+    }}} """
+
+    return sum(getsize(i) for i in task if isinstance(i, str) and isfile(i))
+# }}}
+
+
+# {{{ run_task
+def run_task(task):
+
+    """ {{{ Docstrings
+
+    Runs a single task within a worker process, given a tuple in the form
+    of:
+
+        (function, arguments, keep)
+
+    Returning a tuple in the form of:
+
+        (error, result)
+
+    As exiting a worker process would hang the pool, error is the message of
+    any exit, or any exception raised, such that it may be raised again by
+    the parent process, else None. Result is the return value of function if
+    keep, else None, rather than returning (and pickling) it needlessly.
+
+    }}} """
+
+    function, arguments, keep = task
+    try:
+        result = function(*arguments)
+        if keep:
+            # A result which cannot be returned would hang the pool
+            dumps(result)
+        else:
+            result = None
+    except SystemExit as e:
+        message = ', '.join(str(i) for i in arguments)
+        return('{0}: {1}'.format(message, e), None)
+    except Exception as e:
+        # As would an exception which cannot be returned
+        try:
+            dumps(e)
+        except Exception:
+            e = RuntimeError(format_exc())
+        return(e, None)
+    return(None, result)
+# }}}
+
+
+# {{{ run_batch
+def run_batch(function, tasks, jobs=1, report=None):
+
+    """ {{{ Docstrings
+
+    Calls function with the arguments of every task (each a tuple, e.g. one
+    of the pairs returned by pair_files), running up to jobs tasks at once
+    on a pool of processes; 0 jobs utilizes every core. Tasks are handed
+    out by this process, largest first, such that a large task does not
+    leave a single process running long after all others have finished,
+    except that no more than MAX_LARGE_FILES large tasks are run at once,
+    smaller tasks being handed out in the meantime, rather than leaving
+    processes idle. Exits upon the first task which exits, as when run one
+    after another, and raises any exception raised by a task.
+
+    If given, report is called by this process with the return value of
+    function for every task, in the order in which the tasks are given, as
+    soon as that task and all preceding it have finished, e.g. to print the
+    output of each task without that of others running at once interleaving
+    therewith.
+
+    }}} """
+
+    tasks = [tuple(i) for i in tasks]
+    if jobs <= 0:
+        jobs = cpu_count()
+    if jobs == 1 or len(tasks) <= 1:
+        for task in tasks:
+            result = function(*task)
+            if report is not None:
+                report(result)
+        return
+    # Largest first, popped from the end; each numbered in the order given
+    tasks = sorted(
+            ((task_size(j), i, j) for i, j in enumerate(tasks)),
+            key=lambda x: x[0]
+            )
+    large = [(i, j) for size, i, j in tasks if size >= LARGE_FILE_SIZE]
+    small = [(i, j) for size, i, j in tasks if size < LARGE_FILE_SIZE]
+    finished = Queue()
+    # Results awaiting report, keyed by task number, and the next thereof
+    results = {}
+    next_result = 0
+    running = 0
+    running_large = 0
+    pool = Pool(min(jobs, len(tasks)))
+    try:
+        while large or small or running:
+            while running < jobs:
+                if large and running_large < MAX_LARGE_FILES:
+                    (number, task), is_large = large.pop(), True
+                elif small:
+                    (number, task), is_large = small.pop(), False
+                else:
+                    break
+                running += 1
+                running_large += is_large
+                pool.apply_async(
+                        run_task, ((function, task, report is not None),),
+                        callback=lambda x, y=number, z=is_large: finished.put(
+                                (x, y, z)
+                                )
+                        )
+            # A timeout keeps the wait interruptible, e.g. by Ctrl-C
+            (error, result), number, is_large = finished.get(True, 1 << 20)
+            running -= 1
+            running_large -= is_large
+            if isinstance(error, BaseException):
+                raise error
+            if error is not None:
+                exit(error)
+            if report is not None:
+                results[number] = result
+                while next_result in results:
+                    report(results.pop(next_result))
+                    next_result += 1
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+# }}}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Shared cache functionality utilized by GO_TPM.py and GODag.py, i.e. the
+# parsed contents of an input file stored as numpy arrays in a ".npz" file
+# alongside it.
+# }}}
+
+
+# {{{ Imports
+from os import getpid, rename, remove
+from os.path import getmtime, getsize
+from zipfile import BadZipfile
+import numpy as np
+from FastaIO import hash_file
+# }}}
+
+
+# {{{ cache_name
+def cache_name(file_name):
+
+    """ {{{ Docstrings
+
+    Returns the name of the cache of a file, i.e. the file name plus ".npz".
+    For instance, Seq_One_GO.txt is cached as Seq_One_GO.txt.npz. The
+    extension is kept, such that files differing only thereby, e.g. go.txt
+    and go.obo, do not share a cache.
+
+    }}} """
+
+    return file_name + '.npz'
+# }}}
+
+
+# {{{ read_cache
+def read_cache(file_name, version, keys):
+
+    """ {{{ Docstrings
+
+    Returns a dictionary of the arrays cached for a file, in the form of:
+
+        dictionary = {
+                'key' : array
+                }
+
+    Or None if the cache is missing, unreadable, of another version or
+    lacking any of the given keys, or if the file has changed since. A file
+    is unchanged if its size and either modification time or SHA-1 hash are
+    those at which it was cached; a cache of which only the modification
+    time differs, e.g. that of a copied or touched file, is validated by
+    hash and refreshed.
+
+    }}} """
+
+    try:
+        with np.load(cache_name(file_name)) as cache:
+            if (
+                    cache['version'] != version or
+                    cache['size'] != getsize(file_name)
+                    ):
+                return None
+            refresh = cache['mtime'] != getmtime(file_name)
+            if refresh and cache['sha1'] != hash_file(file_name):
+                return None
+            arrays = dict((i, cache[i]) for i in keys)
+    except (IOError, KeyError, ValueError, BadZipfile):
+        return None
+    if refresh:
+        write_cache(file_name, version, arrays)
+    return arrays
+# }}}
+
+
+# {{{ write_cache
+def write_cache(file_name, version, arrays):
+
+    """ {{{ Docstrings
+
+    Writes a dictionary of arrays to the cache of a file (see read_cache),
+    via a temporary file, such that a partially written cache is never read.
+    The cache is skipped if it cannot be written, e.g. in a read only
+    directory.
+
+    }}} """
+
+    name = cache_name(file_name)
+    temp_name = '{0}.{1}.tmp'.format(name, getpid())
+    try:
+        with open(temp_name, 'wb') as f:
+            np.savez(
+                    f, version=version, size=getsize(file_name),
+                    mtime=getmtime(file_name), sha1=hash_file(file_name),
+                    **arrays
+                    )
+        rename(temp_name, name)
+    except (IOError, OSError):
+        try:
+            remove(temp_name)
+        except OSError:
+            pass
+# }}}
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Cysteine framework scanning utilized by ShK.py.
+# }}}
+
+
+# {{{ Imports
+from bisect import bisect_left
+from collections import deque
+import re
+# }}}
+
+
+# {{{ Globals
+# All possible values in peptide sequence; any other character (e.g. "*", "X")
+# may not occur within a domain
+AMINO_ACIDS = 'ARNDCQEGHILKMFPSTWYV'
+NOT_AMINO_ACID = re.compile('[^' + AMINO_ACIDS + ']')
+# Pre-filter stages (see reject_stage), in the order in which they are
+# applied, and their descriptions
+REJECT_STAGES = (
+        ('length', 'shorter than the framework'),
+        ('cysteines', 'too few cysteines'),
+        ('span', 'cysteines span shorter than the framework')
+        )
+# Gap element of a motif pattern, i.e. x(m), x(m,n) or x(m,*)
+GAP_TOKEN = re.compile(r'^X\((\d+)(?:,(\d+|\*))?\)$')
+# }}}
+
+
+# {{{ cys_positions
+def cys_positions(seq):
+
+    """ {{{ Docstrings
+
+    Returns the positions of all cysteines within a peptide sequence, in
+    ascending order.
+
+    }}} """
+
+    positions = []
+    i = seq.find('C')
+    while i != -1:
+        positions.append(i)
+        i = seq.find('C', i + 1)
+    return positions
+# }}}
+
+
+# {{{ run_starts
+def run_starts(seq, positions):
+
+    """ {{{ Docstrings
+
+    Returns, for each position given, the position at which the uninterrupted
+    run of amino acids containing it begins, i.e. one past the nearest
+    preceding character which is not an amino acid.
+
+    }}} """
+
+    breaks = [m.start() for m in NOT_AMINO_ACID.finditer(seq)]
+    if not breaks:
+        return [0] * len(positions)
+    starts = []
+    for i in positions:
+        j = bisect_left(breaks, i)
+        starts.append(breaks[j - 1] + 1 if j else 0)
+    return starts
+# }}}
+
+
+# {{{ reject_stage
+def reject_stage(seq, min_length, n_cys):
+
+    """ {{{ Docstrings
+
+    Returns the name of the first pre-filter stage (see REJECT_STAGES) by
+    which a peptide sequence cannot possibly contain a framework of at least
+    min_length residues and n_cys cysteines, or None if it must be scanned.
+
+    }}} """
+
+    if len(seq) < min_length:
+        return 'length'
+    if seq.count('C') < n_cys:
+        return 'cysteines'
+    if seq.rfind('C') - seq.find('C') + 1 < min_length:
+        return 'span'
+    return None
+# }}}
+
+
+# {{{ CysFramework
+class CysFramework(object):
+
+    """ {{{ Docstrings
+
+    A class in which a cysteine framework, i.e. a series of cysteines
+    separated by a given number of residues, is stored and searched for.
+
+    The framework is defined by its name and a sequence of gaps, one per pair
+    of consecutive cysteines, in the form of:
+
+        ((minimum, maximum), (minimum, maximum), ...)
+
+    Where minimum and maximum are the number of residues (of any kind,
+    including cysteine) allowed between the two cysteines and a maximum of
+    None is unbounded. For instance, the ShK domain, C[...]+C[...]+C[...]{1,50}
+    C[...]{3}C[...]{2}C, is defined as:
+
+        ((1, None), (1, None), (1, 50), (3, 3), (2, 2))
+
+    Rather than utilizing regular expressions, which backtrack over every
+    combination of the unbounded gaps, the cysteine positions are indexed once
+    per sequence and the spacing rules are checked directly, such that run
+    time is linear in the length of the sequence.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, name, gaps):
+        self.name = name
+        self.gaps = tuple(gaps)
+        # Number of cysteines in the framework
+        self.n_cys = len(self.gaps) + 1
+        # Minimum number of residues spanned by the framework
+        self.min_length = self.n_cys + sum(i[0] for i in self.gaps)
+    # }}}
+
+    # {{{ reject
+    def reject(self, seq):
+
+        """ {{{ Docstrings
+
+        Cheaply determines whether a peptide sequence cannot possibly contain
+        the framework, prior to the comparatively expensive scan. Returns the
+        name of the first pre-filter stage (see reject_stage) which rejects
+        the sequence, or None if the sequence must be scanned.
+
+        }}} """
+
+        return reject_stage(seq, self.min_length, self.n_cys)
+    # }}}
+
+    # {{{ scan
+    def scan(self, seq, positions=None, starts=None):
+
+        """ {{{ Docstrings
+
+        Returns a list of all occurrences of the framework within a peptide
+        sequence, in the form of:
+
+            [(start, end), (start, end)]
+
+        Where start and end are zero-based, end exclusive, as with python
+        slicing. One occurrence is reported for each cysteine which may close
+        the framework, utilizing the nearest preceding cysteines which satisfy
+        the spacing rules, such that overlapping occurrences are all reported.
+        Cysteine positions and run starts (see cys_positions and run_starts)
+        may be given if already computed for the sequence.
+
+        }}} """
+
+        if positions is None:
+            positions = cys_positions(seq)
+        if len(positions) <= len(self.gaps):
+            return []
+        if starts is None:
+            starts = run_starts(seq, positions)
+        # Latest possible start of a partial framework ending at each
+        # cysteine; initially, each cysteine begins a framework of its own
+        best = list(positions)
+        for min_gap, max_gap in self.gaps:
+            best = self.extend(positions, starts, best, min_gap, max_gap)
+        return [
+                (start, positions[j] + 1) for j, start in enumerate(best)
+                if start is not None
+                ]
+    # }}}
+
+    # {{{ extend
+    @staticmethod
+    def extend(positions, starts, best, min_gap, max_gap):
+
+        """ {{{ Docstrings
+
+        Extends every partial framework by one cysteine, given the latest
+        possible start of the partial framework ending at each cysteine.
+        The preceding cysteines eligible for each cysteine form a window
+        which only ever moves forward, such that the maximum start within it
+        is maintained with a monotonic queue.
+
+        }}} """
+
+        extended = []
+        window = deque()
+        hi = 0
+        for j, pos in enumerate(positions):
+            # Admit cysteines at least min_gap residues upstream
+            while hi < j and positions[hi] < pos - min_gap:
+                if best[hi] is not None:
+                    while window and best[window[-1]] <= best[hi]:
+                        window.pop()
+                    window.append(hi)
+                hi += 1
+            # Evict cysteines more than max_gap residues upstream
+            if max_gap is not None:
+                while window and positions[window[0]] < pos - max_gap - 1:
+                    window.popleft()
+            # Discard frameworks interrupted by a non amino acid character
+            if window and best[window[0]] >= starts[j]:
+                extended.append(best[window[0]])
+            else:
+                extended.append(None)
+        return extended
+    # }}}
+# }}}
+
+
+# {{{ MotifLibrary
+class MotifLibrary(object):
+
+    """ {{{ Docstrings
+
+    A class in which a library of cysteine frameworks is stored and searched
+    for in a single pass. The cysteine positions of each sequence are
+    indexed once and shared by every framework, and each occurrence is
+    tagged with the name of the framework it matched.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, frameworks):
+        self.frameworks = list(frameworks)
+        # Pre-filter thresholds are those of the most permissive framework
+        self.n_cys = min(i.n_cys for i in self.frameworks)
+        self.min_length = min(i.min_length for i in self.frameworks)
+    # }}}
+
+    # {{{ read_motif_file
+    @classmethod
+    def read_motif_file(cls, motif_file):
+
+        """ {{{ Docstrings
+
+        Reads a motif definition file, with one framework per line in the
+        form of:
+
+            name\tpattern\n
+
+        Where pattern is written in PROSITE-like notation, e.g.
+
+            ShK\tC-x(1,*)-C-x(1,*)-C-x(1,50)-C-x(3)-C-x(2)-C\n
+
+        "x(m)" means exactly m residues, "x(m,n)" means m through n residues
+        and "x(m,*)" means m or more residues, while two adjacent cysteines
+        are written "C-C". Empty lines and lines beginning with "#" are
+        ignored.
+
+        }}} """
+
+        frameworks = []
+        with open(motif_file, 'r') as motifs:
+            for line_number, line in enumerate(motifs, 1):
+                line = line.strip()
+                if not line or line[0] == '#':
+                    continue
+                line = line.split(None, 1)
+                try:
+                    if len(line) != 2:
+                        raise ValueError('expected name and pattern')
+                    frameworks.append(
+                            CysFramework(line[0], parse_pattern(line[1]))
+                            )
+                except ValueError as e:
+                    raise ValueError('{0}, line {1}: {2}'.format(
+                            motif_file, line_number, e
+                            ))
+        if not frameworks:
+            raise ValueError('{0}: no motifs defined'.format(motif_file))
+        return cls(frameworks)
+    # }}}
+
+    # {{{ reject
+    def reject(self, seq):
+
+        """ {{{ Docstrings
+
+        As CysFramework.reject, rejecting only those sequences which cannot
+        possibly contain any framework within the library.
+
+        }}} """
+
+        return reject_stage(seq, self.min_length, self.n_cys)
+    # }}}
+
+    # {{{ scan
+    def scan(self, seq):
+
+        """ {{{ Docstrings
+
+        Returns a list of all occurrences of every framework within a
+        peptide sequence, in the form of:
+
+            [('name', start, end), ('name', start, end)]
+
+        Ordered by framework, as defined in the library, and then by end.
+        See CysFramework.scan.
+
+        }}} """
+
+        positions = cys_positions(seq)
+        starts = run_starts(seq, positions)
+        hits = []
+        for framework in self.frameworks:
+            for start, end in framework.scan(seq, positions, starts):
+                hits.append((framework.name, start, end))
+        return hits
+    # }}}
+# }}}
+
+
+# {{{ parse_pattern
+def parse_pattern(pattern):
+
+    """ {{{ Docstrings
+
+    Parses a PROSITE-like cysteine framework pattern (see
+    MotifLibrary.read_motif_file) into a sequence of gaps as accepted by
+    CysFramework.
+
+    }}} """
+
+    tokens = pattern.replace(' ', '').upper().split('-')
+    if tokens[0] != 'C' or tokens[-1] != 'C':
+        raise ValueError('pattern must begin and end with C')
+    gaps = []
+    # Whether the previous token was a cysteine
+    after_cys = False
+    for token in tokens:
+        if token == 'C':
+            if after_cys:
+                gaps.append((0, 0))
+            after_cys = True
+            continue
+        gap = GAP_TOKEN.match(token)
+        if not gap or not after_cys:
+            raise ValueError('invalid pattern element {0}'.format(token))
+        min_gap = int(gap.group(1))
+        if gap.group(2) is None:
+            max_gap = min_gap
+        elif gap.group(2) == '*':
+            max_gap = None
+        else:
+            max_gap = int(gap.group(2))
+            if max_gap < min_gap:
+                raise ValueError('invalid pattern element {0}'.format(token))
+        gaps.append((min_gap, max_gap))
+        after_cys = False
+    if not gaps:
+        raise ValueError('pattern must contain at least two cysteines')
+    return gaps
+# }}}
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Shared enrichment testing functionality utilized by GO_TPM.py, i.e.
+# hypergeometric tests of any number of terms against any number of
+# foreground sets at once and the Benjamini-Hochberg correction thereof.
+# }}}
+
+
+# {{{ Imports
+import numpy as np
+# }}}
+
+
+# {{{ Globals
+# ::MODIFIABLE::
+# Maximum number of probabilities computed at once by hypergeometric_sf
+BLOCK_SIZE = 1 << 20
+# }}}
+
+
+# {{{ log_factorials
+def log_factorials(n):
+
+    """ {{{ Docstrings
+
+    Returns an array of the natural logarithm of the factorial of every
+    integer from 0 through n.
+
+    }}} """
+
+    table = np.zeros(n + 1)
+    table[1:] = np.cumsum(np.log(np.arange(1, n + 1)))
+    return table
+# }}}
+
+
+# {{{ hypergeometric_sf
+def hypergeometric_sf(k, K, n, N):
+
+    """ {{{ Docstrings
+
+    Returns the probability of drawing at least k successes in n draws,
+    without replacement, from a population of N containing K successes (i.e.
+    the upper tail of the hypergeometric distribution, or one-sided Fisher's
+    exact test), given arrays of equal shape.
+
+    Every distinct (K, n, N) shares a single distribution, which is computed
+    once, in its entirety, from log factorials and summed from its upper
+    end, such that even the smallest probabilities are exact to within
+    rounding. Distributions of similar length are computed together, as rows
+    of a two dimensional array of at most BLOCK_SIZE elements.
+
+    }}} """
+
+    k, K, n, N = [
+            np.asarray(i, dtype=np.int64)
+            for i in np.broadcast_arrays(k, K, n, N)
+            ]
+    shape = k.shape
+    k, K, n, N = k.ravel(), K.ravel(), n.ravel(), N.ravel()
+    sf = np.ones(len(k))
+    if not len(k):
+        return sf.reshape(shape)
+    table = log_factorials(N.max())
+    # Distinct distributions, and that of each probability
+    keys, inverse = np.unique(
+            np.column_stack((K, n, N)), axis=0, return_inverse=True
+            )
+    dist_K, dist_n, dist_N = keys.T
+    # Support of each distribution
+    low = np.maximum(0, dist_n + dist_K - dist_N)
+    high = np.minimum(dist_n, dist_K)
+    lengths = high - low + 1
+    log_total = table[dist_N] - table[dist_n] - table[dist_N - dist_n]
+    # Upper tail of each distribution, from low through high, concatenated
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    tails = np.empty(offsets[-1])
+    order = np.argsort(lengths, kind='mergesort')
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while (
+                end < len(order) and
+                (end - start + 1) * lengths[order[end]] <= BLOCK_SIZE
+                ):
+            end += 1
+        rows = order[start:end]
+        width = lengths[rows[-1]]
+        x = low[rows, None] + np.arange(width)
+        valid = x <= high[rows, None]
+        x = np.where(valid, x, low[rows, None])
+        Kx = dist_K[rows, None]
+        nx = dist_n[rows, None]
+        Nx = dist_N[rows, None]
+        log_pmf = (
+                table[Kx] - table[x] - table[Kx - x] +
+                table[Nx - Kx] - table[nx - x] - table[Nx - Kx - nx + x] -
+                log_total[rows, None]
+                )
+        pmf = np.where(valid, np.exp(log_pmf), 0.0)
+        tail = np.cumsum(pmf[:, ::-1], axis=1)[:, ::-1]
+        tails[(offsets[rows, None] + np.arange(width))[valid]] = tail[valid]
+        start = end
+    dist_low = low[inverse]
+    dist_high = high[inverse]
+    inside = (k > dist_low) & (k <= dist_high)
+    sf[k > dist_high] = 0.0
+    sf[inside] = tails[offsets[inverse[inside]] + k[inside] - dist_low[inside]]
+    return np.minimum(sf, 1.0).reshape(shape)
+# }}}
+
+
+# {{{ benjamini_hochberg
+def benjamini_hochberg(p_values):
+
+    """ {{{ Docstrings
+
+    Returns the Benjamini-Hochberg adjusted p-values (q-values) of an array
+    of p-values, each column (if two dimensional) being a family of tests.
+
+    }}} """
+
+    p_values = np.asarray(p_values, dtype=float)
+    m = len(p_values)
+    if not m:
+        return p_values.copy()
+    columns = p_values.reshape(m, -1)
+    order = np.argsort(columns, axis=0, kind='mergesort')
+    index = np.arange(columns.shape[1])
+    ranks = np.arange(1, m + 1, dtype=float)[:, None]
+    # Minimum of p * m / rank over every rank from each onward
+    q_values = np.minimum.accumulate(
+            (columns[order, index] * m / ranks)[::-1], axis=0
+            )[::-1]
+    adjusted = np.empty_like(columns)
+    adjusted[order, index] = np.minimum(q_values, 1.0)
+    return adjusted.reshape(p_values.shape)
+# }}}
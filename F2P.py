@@ -14,8 +14,36 @@
 
 # {{{ Imports
 from os import getcwd, listdir
-from random import randrange
+from os.path import exists, basename, splitext
+import re
+from hashlib import sha1
 import argparse
+from sys import exit
+import numpy as np
+from Batch import run_batch
+from FastaIO import split_header
+from Alignment import (
+        AlignmentMatrix, PhylipWriter, NexusWriter, FastaWriter,
+        export_alignment, guess_datatype, site_patterns, locus_partitions,
+        fill_supermatrix
+        )
+# }}}
+
+
+# {{{ Globals
+# ::MODIFIABLE::
+# Number of characters of each sequence per block of interleaved phylip file
+# (and per line of fasta file)
+BLOCK_WIDTH = 50
+# Number of rows of the alignment matrix read at a time when exporting
+ROWS_PER_CHUNK = 1000
+# Suffix of each output file, given its format
+EXTENSIONS = {
+        'phylip': '.phylip',
+        'relaxed': '_relaxed.phylip',
+        'nexus': '.nex',
+        'fasta': '.fas'
+        }
 # }}}
 
 
@@ -33,54 +61,132 @@ class FastaFile(object):
 
         """ {{{ Docstrings
 
-        Reads fasta file into dictionary, whose keys are the original sequence
-        identifiers and values are the corresponding sequences, given the
-        name of the fasta file as a string.
+        Parses the fasta file into an alignment matrix (see
+        Alignment.AlignmentMatrix), given the name of the fasta file as a
+        string. The matrix is cached alongside the fasta file, such that
+        subsequent conversions of the same alignment need not parse it again.
+        Exits if the sequences are not aligned, i.e. not all of equal length.
+
+        }}} """
+
+        try:
+            return AlignmentMatrix(fasta_file)
+        except ValueError as e:
+            exit(str(e))
+    # }}}
+
+    # {{{ collapse_identical
+    def collapse_identical(self, alignment):
+
+        """ {{{ Docstrings
+
+        Groups identical sequences by their SHA-1 digest, keeping only the
+        first row of each group. Returns a list of the remaining rows of the
+        alignment matrix and a list of (representative ID, member ID)
+        tuples, one per original sequence ID.
 
         }}} """
 
-        # Open fasta file in read mode
-        with open(fasta_file, 'r') as fasta:
-            # Read into list
-            fasta = fasta.readlines()
-        # Filter out sequence IDs and strip each entry of leading/trailing
-        # whitespace
-        # TODO: Remove greater than (">") symbol?
-        seq_IDs = [line.strip() for line in fasta if line[0] == '>']
-        # Filter out nucleotide sequences and strip each entry of
-        # leading/trailing whitespace
-        seqs = [line.strip() for line in fasta if line[0] != '>']
-        # Concatenate into dictionary
-        seq_dict = dict(zip(seq_IDs, seqs))
-        return seq_dict
+        collapsed_rows = []
+        # Representative row of each unique sequence, keyed by digest
+        representatives = {}
+        members = []
+        for row, ID in enumerate(alignment.ids):
+            key = sha1(alignment.fetch(row)).digest()
+            if key not in representatives:
+                representatives[key] = row
+                collapsed_rows.append(row)
+            members.append((alignment.ids[representatives[key]], ID))
+        return(collapsed_rows, members)
+    # }}}
+
+    # {{{ read_dictionary_file
+    def read_dictionary_file(self, dictionary_name):
+
+        """ {{{ Docstrings
+
+        Reads the unique and original IDs of a dictionary file written by a
+        previous run, if any, into two numpy arrays of strings, in the order
+        in which they occur in the file. Exits if the file is malformed.
+        Dictionary files written by earlier versions, of which the original
+        IDs are entire headers (e.g. ">Seq_ID description"), are read as the
+        sequence IDs thereof, such that their unique IDs are reused.
+
+        }}} """
+
+        unique_IDs = []
+        original_IDs = []
+        if exists(dictionary_name):
+            with open(dictionary_name, 'r') as dfile:
+                for line_number, line in enumerate(dfile, 1):
+                    line = line.rstrip('\r\n').split('\t', 1)
+                    if len(line) != 2 or not line[0].isdigit():
+                        exit(
+                                '{0}, line {1}: expected unique and original '
+                                'ID.'.format(dictionary_name, line_number)
+                                )
+                    # Legacy original ID, i.e. entire header
+                    if line[1].startswith('>'):
+                        line[1] = split_header(line[1][1:])[0]
+                    unique_IDs.append(line[0])
+                    original_IDs.append(line[1])
+        return(
+                np.array(unique_IDs, dtype=str),
+                np.array(original_IDs, dtype=str)
+                )
     # }}}
 
     # {{{ generate_unique_ids
-    def generate_unique_ids(self, original_seq_dict):
+    def generate_unique_ids(self, original_IDs, dictionary_name):
 
         """ {{{ Docstrings
 
-        Randomly generate unique identifier (integer from 0 through 9999999999)
-        and use as key in two dictionaries. The first contains each unique ID
-        as keys and corresponding sequences as values. The second contains each
-        unique ID as keys and each corresponding original ID as values.
+        Assigns a unique identifier, a zero-padded integer of 10 digits, to
+        each original sequence ID, reusing those already assigned within the
+        dictionary file of a previous run. Original IDs occurring more than
+        once are matched by occurrence, i.e. the second occurrence of an ID
+        receives the unique ID of its second occurrence in the dictionary
+        file. Sequences not found in the dictionary file are assigned the
+        lowest integers not yet in use, such that IDs are reproducible and
+        never collide. Returns a list of the unique ID of each original ID
+        and a list of (unique ID, original ID) tuples assigned anew.
+
+        The lookup is performed on numpy arrays, rather than dictionaries,
+        such that memory remains modest for millions of sequences.
 
         }}} """
 
-        # Initiate two empy dictionaries in which pertinent variables are
-        # stored
-        unique_seq_dict = {}
-        unique_ID_dict = {}
-        # Iterate over key, value pairs
-        for ID, seq in original_seq_dict.iteritems():
-            # Define variables for readability
-            original_ID = ID
-            # Generate unique ID
-            unique_ID = randrange(0, 9999999999)
-            # Define key, value paris in novel dictionaries
-            unique_seq_dict[unique_ID] = seq
-            unique_ID_dict[unique_ID] = original_ID
-        return(unique_seq_dict, unique_ID_dict)
+        old_unique, old_original = self.read_dictionary_file(dictionary_name)
+        original_IDs = np.array(original_IDs, dtype=str)
+        # Integer code of each distinct original ID, shared by both arrays
+        codes = np.unique(
+                np.concatenate((old_original, original_IDs)),
+                return_inverse=True
+                )[1]
+        old_keys = occurrence_keys(codes[:len(old_original)], len(codes))
+        keys = occurrence_keys(codes[len(old_original):], len(codes))
+        # Locate each original ID within the dictionary file
+        order = np.argsort(old_keys)
+        found = np.zeros(len(keys), dtype=bool)
+        matches = np.zeros(len(keys), dtype=np.intp)
+        if len(old_keys):
+            position = np.searchsorted(old_keys[order], keys)
+            position[position == len(order)] = 0
+            matches = order[position]
+            found = old_keys[matches] == keys
+        # Lowest integers not assigned by the dictionary file
+        used = old_unique.astype(np.int64)
+        free = np.setdiff1d(
+                np.arange(len(used) + len(keys), dtype=np.int64), used
+                )[:np.count_nonzero(~found)]
+        new_IDs = ['{0:010d}'.format(i) for i in free]
+        unique_IDs = np.empty(len(keys), dtype=object)
+        unique_IDs[found] = old_unique[matches[found]]
+        unique_IDs[~found] = new_IDs
+        return(
+                unique_IDs.tolist(),
+                zip(new_IDs, original_IDs[~found].tolist())
+                )
     # }}}
 # }}}
 
@@ -90,7 +196,8 @@ class PhylipFile(FastaFile):
 
     """ {{{ Docstrings
 
-    A class in which phylip file output functionality is stored.
+    A class in which phylip (and nexus and fasta) file output functionality
+    is stored.
 
     }}} """
 
@@ -114,6 +221,32 @@ class PhylipFile(FastaFile):
                         ),
                 action='store_true'
                 )
+        args_phylip.add_argument(
+                '-F', '--formats', nargs='+', help=(
+                        'Formats in which to write alignment, in a single '
+                        'pass: strict phylip (IDs padded to 10 characters), '
+                        'relaxed phylip, nexus and/or fasta.'
+                        ),
+                choices=('phylip', 'relaxed', 'nexus', 'fasta'),
+                default=['phylip']
+                )
+        args_phylip.add_argument(
+                '-c', '--collapse', help=(
+                        'Collapse identical sequences, writing only the first '
+                        'ID of each to the phylip files and the membership of '
+                        'each group to a "_members.txt" file.'
+                        ),
+                action='store_true'
+                )
+        args_phylip.add_argument(
+                '-p', '--patterns', help=(
+                        'Additionally write the alignment compressed to its '
+                        'unique site patterns ("_patterns" files), along '
+                        'with the number of columns exhibiting each pattern '
+                        '(a "_weights.txt" file, one weight per line).'
+                        ),
+                action='store_true'
+                )
     # }}}
 
     # {{{ __init__
@@ -126,101 +259,130 @@ class PhylipFile(FastaFile):
 
         }}} """
 
-        original_phylip_name = self._path.replace(
-                '.fasta', '_original.phylip'
-                )
-        unique_phylip_name = self._path.replace(
-                '.fasta', '_unique.phylip'
-                )
         dictionary_name = self._path.replace('.fasta', '.txt')
-        original_seq_dict = self.get_original_data(fasta_file)
-        unique_seq_dict, unique_ID_dict = self.generate_unique_ids(
-                original_seq_dict
-                )
-        if args.sequential:
-            self.write_phylip_file_sequential(
-                    original_seq_dict, original_phylip_name
+        alignment = self.get_original_data(fasta_file)
+        rows = range(alignment.ntax)
+        if args.collapse:
+            rows, members = self.collapse_identical(alignment)
+            self.write_members_file(
+                    members, self._path.replace('.fasta', '_members.txt')
                     )
-            self.write_phylip_file_sequential(
-                    unique_seq_dict, unique_phylip_name
+        # Unique site patterns, if requested, and their weights
+        patterns = [None]
+        if args.patterns:
+            columns, weights = site_patterns(alignment, rows, ROWS_PER_CHUNK)
+            patterns.append(columns)
+            self.write_weights_file(
+                    weights, self._path.replace('.fasta', '_weights.txt')
                     )
-        else:
-            self.write_phylip_file_interleaved(
-                    original_seq_dict, original_phylip_name
+            print(
+                    '{0}: {1} unique site patterns of {2} columns.'.format(
+                            fasta_file, len(columns), alignment.nchar
+                            )
                     )
-            self.write_phylip_file_interleaved(
-                    unique_seq_dict, unique_phylip_name
+        original_IDs = [alignment.ids[row] for row in rows]
+        unique_IDs, new_IDs = self.generate_unique_ids(
+                original_IDs, dictionary_name
+                )
+        # Open a writer for each requested format, with both original and
+        # unique IDs, and export to all of them in a single pass
+        writers = []
+        for label, names in (
+                ('original', original_IDs),
+                ('unique', unique_IDs)
+                ):
+            for output_format in args.formats:
+                for columns in patterns:
+                    suffix = '' if columns is None else '_patterns'
+                    writers.append(self.open_writer(
+                            output_format, alignment, names,
+                            self._path.replace('.fasta', '_{0}{1}{2}'.format(
+                                    label, suffix, EXTENSIONS[output_format]
+                                    )),
+                            columns
+                            ))
+        export_alignment(alignment, rows, writers, ROWS_PER_CHUNK)
+        self.write_dictionary_file(new_IDs, dictionary_name)
+    # }}}
+
+    # {{{ open_writer
+    def open_writer(
+            self, output_format, alignment, names, output_file, columns=None
+            ):
+
+        """ {{{ Docstrings
+
+        Returns a writer (see Alignment.AlignmentWriter) for the given output
+        format, given an alignment matrix, the name of each row to be written
+        and name of novel file to be written to, writing only the given
+        columns, if any. Phylip files are written in interleaved format,
+        unless the user specified the sequential flag.
+
+        }}} """
+
+        if output_format in ('phylip', 'relaxed'):
+            return PhylipWriter(
+                    output_file, names, alignment.nchar,
+                    interleaved=not args.sequential,
+                    relaxed=output_format == 'relaxed',
+                    block_width=BLOCK_WIDTH, columns=columns
+                    )
+        if output_format == 'nexus':
+            return NexusWriter(
+                    output_file, names, alignment.nchar,
+                    guess_datatype(alignment.matrix), columns=columns
                     )
-        self.write_dictionary_file(unique_ID_dict, dictionary_name)
+        return FastaWriter(
+                output_file, names, alignment.nchar, line_width=BLOCK_WIDTH,
+                columns=columns
+                )
     # }}}
 
-    # {{{ write_phylip_file_sequential
-    def write_phylip_file_sequential(self, seq_dictionary, phylip_file):
+    # {{{ write_weights_file
+    def write_weights_file(self, weights, weights_name):
 
         """ {{{ Docstrings
 
-        A phylip file is written in sequential format, given a sequence
-        dictionary and name of novel phylip file to be written to.
+        Writes the weight of each site pattern, i.e. the number of columns
+        exhibiting it, one per line, in the order of the compressed
+        alignment, as accepted by e.g. RAxML (-a).
 
         }}} """
 
-        # Open phylip file in write mode
-        with open(phylip_file, 'w') as phy:
-            # Iterate over key, value pairs
-            for ID, seq in seq_dictionary.iteritems():
-                # Define line
-                line = '{0}\t{1}\t'.format(ID, seq)
-                # Write to file
-                phy.write(line)
+        with open(weights_name, 'w') as wfile:
+            wfile.write(''.join('{0}\n'.format(i) for i in weights))
     # }}}
 
-    # {{{ write_phylip_file_interleaved
-    def write_phylip_file_interleaved(self, seq_dictionary, phylip_file):
+    # {{{ write_members_file
+    def write_members_file(self, members, members_name):
 
         """ {{{ Docstrings
 
-        A phylip file is written in interleaved format, given a sequence
-        dictionary and name of novel phylip file to be written to.
+        Writes representative and member IDs of each group of identical
+        sequences to tab-delimited file.
 
         }}} """
 
-        # Open phylip file in write mode
-        with open(phylip_file, 'w') as phy:
-            # Iterate over key, value pairs
-            for ID, seq in seq_dictionary.iteritems():
-                # Define line
-                line = '{0}\t{1}\n'.format(ID, seq[0:51])
-                # Write to file, only including first 50 characters of
-                # "seq" value
-                phy.write(line)
-            # Write empty line to file
-            phy.write('\n')
-            # Iterate over values
-            for seq in seq_dictionary.itervalues():
-                # Iterate over sequence, starting from nucleotide at position
-                # 51, in increments of 50 nucleotides
-                for position in range(51, len(seq), 50):
-                    # Define line
-                    line = '{0}\n'.format(seq[position:position + 50])
-                    # Write nucleotides to file
-                    phy.write(line)
-                # Write empty line to file
-                phy.write('\n')
-        # }}}
+        with open(members_name, 'w') as mfile:
+            mfile.write('representative_id\tseq_id\n')
+            for representative, member in members:
+                mfile.write('{0}\t{1}\n'.format(representative, member))
+    # }}}
 
     # {{{ write_dictionary
-    def write_dictionary_file(self, unique_ID_dict, dictionary_name):
+    def write_dictionary_file(self, new_IDs, dictionary_name):
 
         """ {{{ Docstrings
 
-        Writes unique and original IDs to tab-delimited file.
+        Appends unique and original IDs assigned anew to tab-delimited file,
+        leaving those of previous runs untouched.
 
         }}} """
 
-        # Open dictionary in write mode
-        with open(dictionary_name, 'w') as dfile:
-            # Iterate over key, value pairs
-            for unique, orig in unique_ID_dict.iteritems():
+        # Open dictionary in append mode
+        with open(dictionary_name, 'a') as dfile:
+            # Iterate over unique, original pairs
+            for unique, orig in new_IDs:
                 # Define line
                 line = '{0}\t{1}\n'.format(unique, orig)
                 # Write to file
@@ -264,6 +426,23 @@ class FastaFile(PhylipFile):
                         ),
                 action='store_true'
                 )
+        arg_parser.add_argument(
+                '-j', '--jobs', type=int, help=(
+                        'Number of fasta files to convert at once in batch '
+                        'mode; 0 utilizes every core.'
+                        ),
+                default=1
+                )
+        arg_parser.add_argument(
+                '-S', '--supermatrix', type=str, metavar='NAME', help=(
+                        'In batch mode, rather than converting each fasta '
+                        'file, concatenate all of them (one locus each) into '
+                        'a single supermatrix in sequential phylip and/or '
+                        'nexus format, joined on sequence ID, and write a '
+                        'RAxML-style partition file ("NAME_partitions.txt").'
+                        ),
+                default=None
+                )
     # }}}
 
     # {{{ __init__
@@ -283,6 +462,137 @@ class FastaFile(PhylipFile):
 # }}}
 
 
+# {{{ Supermatrix
+class Supermatrix(object):
+
+    """ {{{ Docstrings
+
+    A class in which a supermatrix is built, given the fasta file of each
+    locus. Every locus is joined on sequence ID, taxa absent from a locus
+    being filled with gaps, and written to its columns of the output files
+    one locus at a time, such that only a single locus is held in memory at
+    any one time.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, fasta_files, name):
+
+        """ {{{ Docstrings
+
+        Upon instantiation of Supermatrix instance, run all pertinent
+        functions.
+
+        }}} """
+
+        loci = sorted(fasta_files)
+        if not loci:
+            exit('No fasta files found from which to build supermatrix.')
+        try:
+            taxa, partitions = locus_partitions(loci)
+        except ValueError as e:
+            exit(str(e))
+        charsets = [
+                (self.locus_name(locus), start + 1, end)
+                for locus, (start, end, datatype) in zip(loci, partitions)
+                ]
+        writers = []
+        for output_format in args.formats:
+            output_file = name + EXTENSIONS[output_format]
+            if output_format in ('phylip', 'relaxed'):
+                writers.append(PhylipWriter(
+                        output_file, taxa, partitions[-1][1],
+                        relaxed=output_format == 'relaxed'
+                        ))
+            elif output_format == 'nexus':
+                datatypes = set(i[2] for i in partitions)
+                writers.append(NexusWriter(
+                        output_file, taxa, partitions[-1][1],
+                        datatypes.pop() if len(datatypes) == 1 else 'PROTEIN',
+                        charsets=charsets
+                        ))
+            else:
+                print('Supermatrix cannot be written in fasta format.')
+        fill_supermatrix(
+                loci, taxa, partitions, [i.reserve() for i in writers],
+                ROWS_PER_CHUNK
+                )
+        for writer in writers:
+            writer.close()
+        self.write_partition_file(
+                charsets, partitions, name + '_partitions.txt'
+                )
+        print(
+                'Concatenated {0} loci of {1} taxa into {2} columns.'.format(
+                        len(loci), len(taxa), partitions[-1][1]
+                        )
+                )
+    # }}}
+
+    # {{{ locus_name
+    @staticmethod
+    def locus_name(fasta_file):
+
+        """ {{{ Docstrings
+
+        Returns the name of a locus, i.e. the name of its fasta file sans
+        extension, with any character other than letters, digits, "_" and
+        "." replaced by "_".
+
+        }}} """
+
+        return re.sub(r'[^\w.]', '_', splitext(basename(fasta_file))[0])
+    # }}}
+
+    # {{{ write_partition_file
+    def write_partition_file(self, charsets, partitions, partition_name):
+
+        """ {{{ Docstrings
+
+        Writes the columns of each locus to a RAxML-style partition file,
+        i.e. one locus per line in the form of:
+
+            DNA, name = start-end\n
+
+        Where protein loci are assigned the WAG model.
+
+        }}} """
+
+        with open(partition_name, 'w') as pfile:
+            for (locus, start, end), partition in zip(charsets, partitions):
+                pfile.write('{0}, {1} = {2}-{3}\n'.format(
+                        'DNA' if partition[2] == 'DNA' else 'WAG',
+                        locus, start, end
+                        ))
+    # }}}
+# }}}
+
+
+# {{{ occurrence_keys
+def occurrence_keys(codes, n):
+
+    """ {{{ Docstrings
+
+    Given the integer code of each of a series of IDs (less than n), returns
+    a key unique to each ID and occurrence thereof, i.e.
+
+        key = code * n + number of preceding occurrences of code
+
+    }}} """
+
+    order = np.argsort(codes, kind='mergesort')
+    ranks = np.arange(len(codes))
+    # Whether each of the sorted codes is the first occurrence thereof
+    first = np.ones(len(codes), dtype=bool)
+    first[1:] = codes[order][1:] != codes[order][:-1]
+    # Rank of the first occurrence of each of the sorted codes
+    first = np.maximum.accumulate(np.where(first, ranks, 0))
+    occurrences = np.empty(len(codes), dtype=np.int64)
+    occurrences[order] = ranks - first
+    return codes.astype(np.int64) * n + occurrences
+# }}}
+
+
 # {{{ Main argument parser
 arg_parser = argparse.ArgumentParser(
         prog='Fasta2Phylip.py',
@@ -291,7 +601,8 @@ arg_parser = argparse.ArgumentParser(
                 'sequential or interleaved format, depending on user '
                 'specification. In total, 3 files will be produced: 1.) A '
                 'phylip file with original IDs. 2.) A phylip file with unique '
-                'IDs. 3.) A dictionary file with unique and original IDs.'
+                'IDs. 3.) A dictionary file with unique and original IDs, '
+                'from which unique IDs are reused on subsequent runs. '
                 'The intended workflow is analgous to the following: '
                 'fasta_file >F2P.py> phylip_file_unique >Analysis> '
                 'output_unique >Rm_Cont.py> output_original. Designed to '
@@ -307,6 +618,8 @@ if __name__ == '__main__':
     FastaFile.add_args()
 # Parse args into namespace objects
 args = arg_parser.parse_args()
+if args.supermatrix and not args.batch:
+    exit('You specified a supermatrix without batch mode. Try again.')
 # Print informative output
 if args.sequential:
     print(
@@ -333,10 +646,17 @@ if args.batch:
     # NOTE: All files you wish to run should contain the string '.fasta' in the
     # name and all files containing this string will be run if you specify
     # the batch flag
-    fasta_files = [x for x in files if '.fasta' in x]
-    # Instantiate intances of FastaFile class for all fasta files found
-    for fasta_file in fasta_files:
-        FastaFile(fasta_file)
+    fasta_files = [
+            x for x in files if '.fasta' in x and
+            not x.endswith(('.fai', '.npy', '.ids', '.stamp'))
+            ]
+    # Concatenate all fasta files found if user specified supermatrix
+    if args.supermatrix:
+        Supermatrix(fasta_files, args.supermatrix)
+    # Instantiate intances of FastaFile class for all fasta files found, up
+    # to jobs at once
+    else:
+        run_batch(FastaFile, [(i,) for i in fasta_files], args.jobs)
 # Else, utilize user-specified string to instantiate single instance of Data
 # class
 else:
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Shared fasta functionality utilized by F2P.py, Pep2Nuc.py, Rm_Cont.py and
+# ShK.py, as well as the stamps by which caches built from any file (e.g. the
+# ".fai" index) are validated against it.
+# }}}
+
+
+# {{{ Imports
+from mmap import mmap, ACCESS_READ
+from os import getpid, rename
+from os.path import getmtime, getsize
+from hashlib import sha1
+# }}}
+
+
+# {{{ read_fasta
+def read_fasta(fasta_file):
+
+    """ {{{ Docstrings
+
+    Generator which reads a fasta file one record at a time, yielding tuples
+    in the form of:
+
+        (seq_ID, description, sequence)
+
+    Where seq_ID is the header up to the first whitespace character (sans the
+    greater than (">") symbol), description is the remainder of the header
+    and sequence is the concatenation of all lines until the next header.
+    Wrapped sequences, empty lines and CRLF line endings are all handled and
+    only a single record is held in memory at any one time.
+
+    }}} """
+
+    header = None
+    seq = []
+    # Open fasta file in read mode
+    with open(fasta_file, 'r') as fasta:
+        # Iterate over lines lazily, rather than reading the entire file
+        for line in fasta:
+            # Strip leading/trailing whitespace, including "\r"
+            line = line.strip()
+            # Skip empty lines
+            if not line:
+                continue
+            if line[0] == '>':
+                # Yield previous record, if any
+                if header is not None:
+                    yield split_header(header) + (''.join(seq),)
+                header = line[1:]
+                seq = []
+            # Ignore any sequence preceding the first header
+            elif header is not None:
+                seq.append(line)
+    # Yield last record
+    if header is not None:
+        yield split_header(header) + (''.join(seq),)
+# }}}
+
+
+# {{{ split_header
+def split_header(header):
+
+    """ {{{ Docstrings
+
+    Splits a fasta header (sans the greater than (">") symbol) into a tuple
+    in the form of:
+
+        (seq_ID, description)
+
+    }}} """
+
+    header = header.split(None, 1)
+    # Header consisting solely of greater than (">") symbol
+    if not header:
+        return('', '')
+    # Header without description
+    if len(header) == 1:
+        return(header[0], '')
+    return(header[0], header[1])
+# }}}
+
+
+# {{{ join_header
+def join_header(seq_ID, description):
+
+    """ {{{ Docstrings
+
+    Inverse of split_header; reconstructs the original header (sans the
+    greater than (">") symbol) given the sequence ID and description.
+
+    }}} """
+
+    if description:
+        return '{0} {1}'.format(seq_ID, description)
+    return seq_ID
+# }}}
+
+
+# {{{ hash_file
+def hash_file(file_name):
+
+    """ {{{ Docstrings
+
+    Returns the SHA-1 hash of a file, reading it in 1MB blocks.
+
+    }}} """
+
+    digest = sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), ''):
+            digest.update(block)
+    return digest.hexdigest()
+# }}}
+
+
+# {{{ file_stamp
+def file_stamp(file_name):
+
+    """ {{{ Docstrings
+
+    Returns the stamp of a file, i.e. a tuple in the form of:
+
+        (size, mtime, sha1)
+
+    Taken prior to building a cache therefrom, such that a file changed in
+    the meantime is not mistaken for that from which the cache was built.
+
+    }}} """
+
+    return(getsize(file_name), getmtime(file_name), hash_file(file_name))
+# }}}
+
+
+# {{{ write_stamp
+def write_stamp(stamp_file, stamp):
+
+    """ {{{ Docstrings
+
+    Writes a stamp (see file_stamp) to a stamp file, tab-delimited, via a
+    temporary file, such that a partially written stamp is never read.
+
+    }}} """
+
+    temp_name = '{0}.{1}.tmp'.format(stamp_file, getpid())
+    with open(temp_name, 'w') as f:
+        f.write('{0}\t{1!r}\t{2}\n'.format(*stamp))
+    rename(temp_name, stamp_file)
+# }}}
+
+
+# {{{ stamp_is_current
+def stamp_is_current(file_name, stamp_file):
+
+    """ {{{ Docstrings
+
+    Returns True if the stamp file of a cache exists and the file from which
+    the cache was built is unchanged since, i.e. of the size and either
+    modification time or SHA-1 hash of the stamp, as with Cache.read_cache;
+    a stamp of which only the modification time differs, e.g. that of a
+    copied or touched file, is validated by hash and refreshed. Thus a file
+    replaced by another of an older modification time (e.g. by "cp -p") is
+    never mistaken for that from which the cache was built.
+
+    }}} """
+
+    try:
+        with open(stamp_file, 'r') as f:
+            size, mtime, digest = f.read().split('\t')
+        size, mtime, digest = int(size), float(mtime), digest.strip()
+    except (IOError, ValueError):
+        return False
+    if size != getsize(file_name):
+        return False
+    if mtime != getmtime(file_name):
+        stamp = file_stamp(file_name)
+        if stamp[2] != digest:
+            return False
+        write_stamp(stamp_file, stamp)
+    return True
+# }}}
+
+
+# {{{ FastaIndex
+class FastaIndex(object):
+
+    """ {{{ Docstrings
+
+    A class in which random access to a fasta file is stored. An offset index
+    in the samtools faidx (".fai") format is built on the first use and
+    reused thereafter, in the form of:
+
+        Seq_ID\tlength\toffset\tline_bases\tline_width\n
+
+    The fasta file itself is memory mapped, such that only the requested
+    slices of each sequence are ever read from disk. As with samtools, every
+    line of a given sequence, except the last, must be of equal length. The
+    index is rebuilt whenever the fasta file differs from that recorded in
+    its stamp (".fai.stamp"; see stamp_is_current).
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, fasta_file):
+        self._path = fasta_file
+        self._index_file = fasta_file + '.fai'
+        stamp_file = self._index_file + '.stamp'
+        if not stamp_is_current(fasta_file, stamp_file):
+            stamp = file_stamp(fasta_file)
+            # Built in full prior to writing, such that an inconsistent
+            # fasta file leaves no partial index behind
+            self.write_index(list(self.build_index()))
+            write_stamp(stamp_file, stamp)
+        self.ids, self._index = self.read_index()
+        self._fasta = open(fasta_file, 'rb')
+        self._mmap = mmap(self._fasta.fileno(), 0, access=ACCESS_READ)
+    # }}}
+
+    # {{{ build_index
+    def build_index(self):
+
+        """ {{{ Docstrings
+
+        Scans the fasta file once, yielding a tuple for each record in the
+        form of:
+
+            (Seq_ID, length, offset, line_bases, line_width)
+
+        Where offset is the byte offset of the first nucleotide.
+
+        }}} """
+
+        record = None
+        # Whether a line shorter than line_bases has been seen for the current
+        # record, in which case it must be the last
+        short = False
+        offset = 0
+        with open(self._path, 'rb') as fasta:
+            for line in fasta:
+                line_width = len(line)
+                line_bases = len(line.rstrip('\r\n'))
+                if line[:1] == '>':
+                    if record is not None:
+                        yield tuple(record)
+                    seq_ID = line[1:].split(None, 1)
+                    seq_ID = seq_ID[0] if seq_ID else ''
+                    record = [seq_ID, 0, offset + line_width, 0, 0]
+                    short = False
+                elif record is not None and line_bases:
+                    if short or (
+                            record[3] and (
+                                line_bases > record[3] or
+                                line_width - line_bases !=
+                                record[4] - record[3]
+                                )
+                            ):
+                        raise ValueError(
+                                'Inconsistent line length in fasta record '
+                                '{0} of {1}.'.format(record[0], self._path)
+                                )
+                    if not record[3]:
+                        record[3] = line_bases
+                        record[4] = line_width
+                    elif line_bases < record[3]:
+                        short = True
+                    record[1] += line_bases
+                elif record is not None:
+                    # Empty lines may only trail a record
+                    short = True
+                offset += line_width
+        if record is not None:
+            yield tuple(record)
+    # }}}
+
+    # {{{ write_index
+    def write_index(self, records):
+
+        """ {{{ Docstrings
+
+        Writes the offset index to the ".fai" file, via a temporary file,
+        such that a partially written index is never read.
+
+        }}} """
+
+        temp_name = '{0}.{1}.tmp'.format(self._index_file, getpid())
+        with open(temp_name, 'w') as fai:
+            for record in records:
+                fai.write('\t'.join(str(i) for i in record) + '\n')
+        rename(temp_name, self._index_file)
+    # }}}
+
+    # {{{ read_index
+    def read_index(self):
+
+        """ {{{ Docstrings
+
+        Reads the ".fai" file into a list of sequence IDs, in the order in
+        which they occur in the fasta file, and a dictionary in the form of:
+
+            dictionary = {
+                    'Seq_ID' : (length, offset, line_bases, line_width)
+                    }
+
+        }}} """
+
+        ids = []
+        index = {}
+        with open(self._index_file, 'r') as fai:
+            for line in fai:
+                line = line.rstrip('\n').split('\t')
+                ids.append(line[0])
+                index[line[0]] = tuple(int(i) for i in line[1:5])
+        return(ids, index)
+    # }}}
+
+    # {{{ __contains__
+    def __contains__(self, seq_ID):
+        return seq_ID in self._index
+    # }}}
+
+    # {{{ length
+    def length(self, seq_ID):
+        return self._index[seq_ID][0]
+    # }}}
+
+    # {{{ fetch
+    def fetch(self, seq_ID, start=0, end=None):
+
+        """ {{{ Docstrings
+
+        Returns the nucleotides at positions start through end (zero-based,
+        end exclusive, as with python slicing) of the given sequence, reading
+        only the corresponding bytes from the memory mapped fasta file.
+
+        }}} """
+
+        length, offset, line_bases, line_width = self._index[seq_ID]
+        if end is None or end > length:
+            end = length
+        if start >= end:
+            return ''
+        # Convert sequence positions into byte offsets, skipping the line
+        # terminators
+        first = offset + (start // line_bases) * line_width + (
+                start % line_bases
+                )
+        last = offset + (end // line_bases) * line_width + (end % line_bases)
+        seq = self._mmap[first:last]
+        if end - start != last - first:
+            seq = seq.replace('\n', '').replace('\r', '')
+        return seq
+    # }}}
+
+    # {{{ close
+    def close(self):
+        self._mmap.close()
+        self._fasta.close()
+    # }}}
+# }}}
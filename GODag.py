@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Shared Gene Ontology graph functionality utilized by GO_TPM.py, i.e. the
+# ancestors of every GO term of an OBO file (e.g. go-basic.obo).
+# }}}
+
+
+# {{{ Imports
+import numpy as np
+from Cache import read_cache, write_cache
+# }}}
+
+
+# {{{ Globals
+# ::MODIFIABLE::
+# Relationships, besides is_a, by which a GO term inherits the annotations of
+# its children
+RELATIONSHIPS = ('part_of',)
+# Namespaces of the GO, in the order of the primary GO categories of
+# GO_TPM.py
+NAMESPACES = ('cellular_component', 'biological_process', 'molecular_function')
+# Version of the format of the ancestor closure cache (".npz"), incremented
+# upon any change thereto, such that caches of a prior version are rebuilt
+CACHE_VERSION = 1
+# Arrays of GODag stored in the ancestor closure cache
+CACHE_ARRAYS = (
+        'terms', 'namespaces', 'indptr', 'indices', 'alt_IDs', 'alt_terms'
+        )
+# }}}
+
+
+# {{{ read_obo
+def read_obo(obo_file):
+
+    """ {{{ Docstrings
+
+    Generator which reads an OBO file one term at a time, yielding tuples in
+    the form of:
+
+        ('GO_ID', 'namespace', ['alt_ID', ...], ['parent GO_ID', ...])
+
+    Where each ID is sans its "GO:" prefix and parents are those related by
+    is_a or any of RELATIONSHIPS. Typedef stanzas are skipped.
+
+    }}} """
+
+    term = None
+    with open(obo_file, 'r') as obo:
+        for line in obo:
+            line = line.strip()
+            if line.startswith('['):
+                if term is not None and term[0] is not None:
+                    yield tuple(term)
+                term = [None, None, [], []] if line == '[Term]' else None
+                continue
+            if term is None or ': ' not in line:
+                continue
+            key, value = line.split(': ', 1)
+            # Strip trailing comments, e.g. "GO:0005737 ! cytoplasm"
+            value = value.split(' !', 1)[0].strip()
+            if key == 'id':
+                term[0] = value[3:]
+            elif key == 'namespace':
+                term[1] = value
+            elif key == 'alt_id':
+                term[2].append(value[3:])
+            elif key == 'is_a':
+                term[3].append(value[3:])
+            elif key == 'relationship':
+                value = value.split()
+                if len(value) > 1 and value[0] in RELATIONSHIPS:
+                    term[3].append(value[1][3:])
+    if term is not None and term[0] is not None:
+        yield tuple(term)
+# }}}
+
+
+# {{{ GODag
+class GODag(object):
+
+    """ {{{ Docstrings
+
+    A class in which the ancestor closure of every GO term of an OBO file is
+    stored, i.e. the term itself and all of its ancestors, each once,
+    irrespective of the number of paths thereto, as compressed sparse row
+    (CSR) arrays in the form of:
+
+        terms = ['GO_ID', 'GO_ID', ...]
+        indices[indptr[i]:indptr[i + 1]] = [term, ancestor, ancestor, ...]
+
+    Where terms are sorted and indices index terms. The closure is built once
+    in topological order and cached alongside the OBO file (e.g.
+    go-basic.obo.npz; see Cache.py), such that subsequent runs merely load it.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, obo_file, cache=True):
+        arrays = None
+        if cache:
+            arrays = read_cache(obo_file, CACHE_VERSION, CACHE_ARRAYS)
+        if arrays is None:
+            arrays = self.build_closure(obo_file)
+            if cache:
+                write_cache(obo_file, CACHE_VERSION, arrays)
+        for i in CACHE_ARRAYS:
+            setattr(self, i, arrays[i])
+    # }}}
+
+    # {{{ build_closure
+    def build_closure(self, obo_file):
+
+        """ {{{ Docstrings
+
+        Reads the OBO file and returns a dictionary of the arrays of the
+        ancestor closure (see above). The ancestors of each term are the
+        union of those of its parents, which are visited first, such that
+        every term is visited once, rather than once per path. Raises
+        ValueError if the OBO file is cyclic.
+
+        }}} """
+
+        records = sorted(read_obo(obo_file))
+        terms = np.array([i[0] for i in records], dtype=str)
+        # Parents which are absent from the OBO file are ignored
+        parents = []
+        for i in records:
+            codes = np.searchsorted(terms, i[3]) if i[3] else []
+            parents.append(sorted(set(
+                    j for j, k in zip(codes, i[3])
+                    if j < len(terms) and terms[j] == k
+                    )))
+        # Kahn's algorithm, visiting every parent prior to its children
+        children = [[] for i in records]
+        pending = [len(i) for i in parents]
+        for i, j in enumerate(parents):
+            for k in j:
+                children[k].append(i)
+        order = [i for i, j in enumerate(pending) if not j]
+        ancestors = [None] * len(records)
+        for i in order:
+            ancestors[i] = set([i]).union(*[ancestors[j] for j in parents[i]])
+            for j in children[i]:
+                pending[j] -= 1
+                if not pending[j]:
+                    order.append(j)
+        if len(order) != len(records):
+            raise ValueError('{0} contains a cycle.'.format(obo_file))
+        indptr = np.zeros(len(records) + 1, dtype=np.intp)
+        indptr[1:] = np.cumsum([len(i) for i in ancestors])
+        indices = np.fromiter(
+                (j for i in ancestors for j in sorted(i)), dtype=np.intc,
+                count=indptr[-1]
+                )
+        alt_IDs = sorted(
+                (j, i) for i, record in enumerate(records) for j in record[2]
+                )
+        namespaces = dict((j, i) for i, j in enumerate(NAMESPACES))
+        return {
+                'terms': terms,
+                'namespaces': np.array(
+                        [namespaces.get(i[1], -1) for i in records],
+                        dtype=np.int8
+                        ),
+                'indptr': indptr,
+                'indices': indices,
+                'alt_IDs': np.array([i for i, j in alt_IDs], dtype=str),
+                'alt_terms': np.array([j for i, j in alt_IDs], dtype=np.intc)
+                }
+    # }}}
+
+    # {{{ term_indices
+    def term_indices(self, GO_IDs):
+
+        """ {{{ Docstrings
+
+        Returns the index of each of an array of GO_IDs (sans "GO:" prefix)
+        within terms, resolving alternate IDs, -1 if absent.
+
+        }}} """
+
+        indices = np.full(len(GO_IDs), -1, dtype=np.intp)
+        for IDs, targets in (
+                (self.alt_IDs, self.alt_terms),
+                (self.terms, np.arange(len(self.terms)))
+                ):
+            if not len(IDs) or not len(GO_IDs):
+                continue
+            found = np.minimum(np.searchsorted(IDs, GO_IDs), len(IDs) - 1)
+            matched = IDs[found] == GO_IDs
+            indices[matched] = targets[found[matched]]
+        return indices
+    # }}}
+
+    # {{{ propagate
+    def propagate(self, GO_IDs, categories, values, counts):
+
+        """ {{{ Docstrings
+
+        Propagates the values (e.g. cumulative TPM; one column per sample if
+        two dimensional) and counts of hits of an array of GO_IDs, with the
+        given primary GO category codes, to every ancestor, each receiving
+        the sum of those of its descendants, each descendant counted once.
+        GO_IDs absent from the OBO file are kept as is. Returns a tuple of
+        arrays in the form of:
+
+            (GO_IDs, categories, values, counts)
+
+        Spanning every term of the OBO file and every absent GO_ID, sorted by
+        GO_ID.
+
+        }}} """
+
+        values = np.asarray(values, dtype=float)
+        counts = np.asarray(counts, dtype=float)
+        indices = self.term_indices(GO_IDs)
+        known = indices >= 0
+        # Term of each element of indices
+        rows = np.repeat(
+                np.arange(len(self.terms)), np.diff(self.indptr)
+                )
+        propagated = []
+        for i in (counts, values):
+            # Each term's own values, summed across any alternate IDs thereof
+            own = np.zeros((len(self.terms),) + i.shape[1:])
+            np.add.at(own, indices[known], i[known])
+            own = own.reshape(len(self.terms), -1)
+            total = np.column_stack([
+                    np.bincount(
+                            self.indices, weights=own[rows, j],
+                            minlength=len(self.terms)
+                            )
+                    for j in range(own.shape[1])
+                    ])
+            total = total.reshape((len(self.terms),) + i.shape[1:])
+            propagated.append(np.concatenate((total, i[~known])))
+        GO_IDs, categories, order, rank = self.merge_IDs(
+                GO_IDs, categories, known
+                )
+        return(GO_IDs, categories, propagated[1][order], propagated[0][order])
+    # }}}
+
+    # {{{ propagate_pairs
+    def propagate_pairs(self, GO_IDs, categories, rows, columns):
+
+        """ {{{ Docstrings
+
+        As propagate, given pairs of arrays of rows (e.g. Seq_ID codes) and
+        columns (indices of GO_IDs) of an incidence matrix rather than
+        values, e.g. that of every sequence and each of its GO_IDs, returning
+        a tuple of arrays in the form of:
+
+            (GO_IDs, categories, rows, columns)
+
+        In which every row is paired with every ancestor of each of its
+        GO_IDs, each pair once, sorted by row, then column.
+
+        }}} """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.intp)
+        indices = self.term_indices(GO_IDs)
+        known = indices >= 0
+        # Codes of GO_IDs absent from the OBO file follow those of the terms
+        codes = np.where(
+                known, indices, len(self.terms) + np.cumsum(~known) - 1
+                )[columns]
+        pairs = codes < len(self.terms)
+        terms = codes[pairs]
+        lengths = self.indptr[terms + 1] - self.indptr[terms]
+        # Position within indices of every ancestor of each pair's term
+        positions = np.repeat(
+                self.indptr[terms] - (np.cumsum(lengths) - lengths), lengths
+                ) + np.arange(lengths.sum())
+        GO_IDs, categories, order, rank = self.merge_IDs(
+                GO_IDs, categories, known
+                )
+        rows = np.concatenate((np.repeat(rows[pairs], lengths), rows[~pairs]))
+        columns = rank[np.concatenate((
+                self.indices[positions], codes[~pairs]
+                ))]
+        keys = np.unique(rows * len(GO_IDs) + columns)
+        return(GO_IDs, categories, keys // len(GO_IDs), keys % len(GO_IDs))
+    # }}}
+
+    # {{{ merge_IDs
+    def merge_IDs(self, GO_IDs, categories, known):
+
+        """ {{{ Docstrings
+
+        Merges the terms of the OBO file and the GO_IDs absent therefrom,
+        returning a tuple in the form of:
+
+            (GO_IDs, categories, order, rank)
+
+        Where GO_IDs and categories are sorted by GO_ID, order sorts the
+        terms followed by the absent GO_IDs and rank is the inverse thereof.
+
+        }}} """
+
+        GO_IDs = np.concatenate((self.terms, np.asarray(GO_IDs)[~known]))
+        categories = np.concatenate((
+                self.namespaces, np.asarray(categories)[~known]
+                ))
+        order = np.argsort(GO_IDs, kind='mergesort')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        return(GO_IDs[order], categories[order], order, rank)
+    # }}}
+# }}}
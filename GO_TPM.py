@@ -1,6 +1,35 @@
-from re import search
 from os import getcwd, listdir
+from os.path import basename, splitext
+from array import array
+from functools import partial
 import argparse
+from sys import exit
+import numpy as np
+from Batch import file_stem, pair_files, run_batch
+from Cache import read_cache, write_cache
+from GODag import GODag
+from Enrichment import hypergeometric_sf, benjamini_hochberg
+
+
+# {{{ Globals
+# Primary GO categories, in the order in which they are written, and their
+# abbreviations
+CATEGORIES = (
+        ('cellular_component', 'CC'),
+        ('biological_process', 'BP'),
+        ('molecular_function', 'MF')
+        )
+# Code of each primary GO category, i.e. its index within CATEGORIES
+CATEGORY_CODES = dict((j[0], i) for i, j in enumerate(CATEGORIES))
+# Version of the format of the parsed GO file cache (".npz"), incremented upon
+# any change thereto, such that caches of a prior version are rebuilt
+CACHE_VERSION = 2
+# Arrays of DataParse stored in the parsed GO file cache
+CACHE_ARRAYS = (
+        'transcripts', 'hit_transcripts', 'hit_codes', 'GO_hits',
+        'hit_categories', 'GO_IDs', 'hit_GO_IDs', 'transcript_order'
+        )
+# }}}
 
 
 # {{{ FileIO class
@@ -11,89 +40,272 @@ class FileIO(object):
 
     Namely:
 
-        1.) A GO.txt/TPM.txt file is read in the form of a list with each
-            item (line) stripped of trailing white space.
+        1.) A GO.txt/TPM.txt file is read one line at a time, each line
+            (sans header) being split into sequence ID and data.
 
-        2.) A concatenated GO/TPM dictionary is written to a file in the form
-            of:
+        2.) Optionally, the GO/TPM data of each sequence is written to a file
+            per primary GO category in the form of:
 
                 transcript_id\tgene_ontology\n
                 Seq_ID\tGO:GO_ID^GO^data:TPM\tGO:GO_ID^GO^data:TPM\n
 
             See docstrings in DataParse for explanation of TPM values.
 
-        3.) Files output by write_concat_GO_dicts are read into list, later to
-            be concatenated into a massive string so that the GO IDs and
-            corresponding TPM values can be extracted.
-
-        4.) A concatenated GO/TPM dictionary is written to a file in the form
+        3.) A cumulative GO/TPM dictionary is written to a file in the form
             of:
 
                 GO_id\tCumulative_TPM\n
                 GO_ID\tTPM
             See docstrings in DataParse for explanation of cumulative TPM.
 
+        4.) The parsed GO file (see DataParse) is cached as integer coded
+            arrays in a ".npz" file alongside it (e.g. Seq_One_GO.txt.npz for
+            Seq_One_GO.txt), which is reused for as long as the size and
+            either modification time or SHA-1 hash of the GO file are
+            unchanged.
+
     }}} """
 
     # {{{ read_GO_TPM_file
-    def read_GO_TPM_file(self, *GO_TPM_file):
+    def read_GO_TPM_file(self, GO_TPM_file):
 
         """ {{{ Docstrings
-        Reads GO and TPM files into dictionary.
+        Generator which reads a GO or TPM file one line at a time, yielding
+        lists in the form of:
+
+            ['Seq_ID', 'data']
+
         }}} """
 
-        dictionary = {}
-        for i in GO_TPM_file:
-            with open(i, 'r') as f:
-                f = f.readlines()[1:]
-            f = map(lambda x: x.strip(), f)
-            if '_GO.txt' in i:
-                dictionary['GO'] = f
-            else:
-                dictionary['TPM'] = f
-        return(dictionary['GO'], dictionary['TPM'])
+        with open(GO_TPM_file, 'r') as f:
+            # Skip header
+            next(f, None)
+            for line in f:
+                line = line.strip()
+                if line:
+                    # Any further columns (e.g. length) are ignored
+                    yield line.split('\t')[0:2]
+    # }}}
+
+    # {{{ read_GO_cache
+    def read_GO_cache(self, GO_file):
+
+        """ {{{ Docstrings
+        Loads the parsed GO file from its cache (see Cache.py), returning
+        True if the cache is valid, else False.
+        }}} """
+
+        arrays = read_cache(GO_file, CACHE_VERSION, CACHE_ARRAYS)
+        if arrays is None:
+            return False
+        for i in CACHE_ARRAYS:
+            setattr(self, i, arrays[i])
+        self.GO_hits = self.GO_hits.tolist()
+        return True
+    # }}}
+
+    # {{{ write_GO_cache
+    def write_GO_cache(self, GO_file):
+        arrays = dict((i, getattr(self, i)) for i in CACHE_ARRAYS)
+        arrays['GO_hits'] = np.array(self.GO_hits, dtype=str)
+        write_cache(GO_file, CACHE_VERSION, arrays)
     # }}}
 
     # {{{ write_concat_GO_dicts
-    def write_concat_GO_dicts(self, *GO_dict):
+    def write_concat_GO_dicts(self, shares):
 
         """ {{{ Docstrings
-        Writes concatenated GO/TPM dictionary to file.
+        Writes the GO hits of each sequence, and its share of TPM, to a file
+        per primary GO category, formatting them only now.
         }}} """
 
-        for i, j in zip(self.IDs[0:3], GO_dict):
-            with open(i, 'w') as f:
-                f.write('transcript_id\tgene_ontology\n')
-                for k, v in j.iteritems():
-                    f.write(k + '\t' + '\t'.join(v) + '\n')
+        categories = self.hit_categories[self.hit_codes]
+        for code, f in enumerate(self.open_category_files()):
+            hits = np.flatnonzero(categories == code)
+            with f:
+                # Primary GO category without hits; header only
+                if not len(hits):
+                    continue
+                transcripts = self.hit_transcripts[hits]
+                # Position of the first hit of each sequence
+                starts = np.flatnonzero(
+                        np.r_[True, np.diff(transcripts) != 0]
+                        )
+                ends = np.r_[starts[1:], len(hits)]
+                for i, j in zip(starts, ends):
+                    GO_hits = self.hit_codes[hits[i:j]]
+                    f.write(self.format_category_line(
+                            self.transcripts[transcripts[i]],
+                            [self.GO_hits[k] for k in GO_hits], shares[hits[i]]
+                            ))
     # }}}
 
-    # {{{ read_concat_file
-    def read_concat_file(self):
+    # {{{ open_category_files
+    def open_category_files(self):
 
         """ {{{ Docstrings
-        Reads files output by write_concat_GO_dicts into list.
+        Opens the file of each primary GO category in write mode, writing
+        its header.
         }}} """
 
-        file_list = []
-        for i in self.IDs[0:3]:
-            with open(i, 'r') as cf:
-                cf = cf.read()
-            file_list.append(cf)
-        return file_list
+        files = []
+        for name in self.IDs[0:3]:
+            f = open(name, 'w')
+            f.write('transcript_id\tgene_ontology\n')
+            files.append(f)
+        return files
+    # }}}
+
+    # {{{ format_category_line
+    def format_category_line(self, transcript, GO_hits, tpm):
+        tpm = ':' + format_TPM(tpm)
+        return transcript + '\t' + '\t'.join(i + tpm for i in GO_hits) + '\n'
+    # }}}
+
+    # {{{ merge_GO_TPM
+    def merge_GO_TPM(self, GO_file, TPM_file):
+
+        """ {{{ Docstrings
+        Generator which merge-joins a GO file and TPM file, both sorted by
+        sequence ID (in byte order, e.g. by "LC_ALL=C sort"), one line at a
+        time, yielding a tuple for every sequence of the GO file in the form
+        of:
+
+            ('Seq_ID', 'GO hits', TPM)
+
+        Sequences absent from the TPM file being assigned a TPM of 0. Raises
+        ValueError if either file is not sorted.
+        }}} """
+
+        TPM_records = self.read_GO_TPM_file(TPM_file)
+        TPM_record = next(TPM_records, None)
+        previous = None
+        for transcript, hits in self.read_GO_TPM_file(GO_file):
+            if previous is not None and transcript < previous:
+                raise ValueError('{0} is not sorted.'.format(GO_file))
+            previous = transcript
+            while TPM_record is not None and TPM_record[0] < transcript:
+                next_record = next(TPM_records, None)
+                if next_record is not None and next_record[0] < TPM_record[0]:
+                    raise ValueError('{0} is not sorted.'.format(TPM_file))
+                TPM_record = next_record
+            if TPM_record is not None and TPM_record[0] == transcript:
+                yield(transcript, hits, float(TPM_record[1]))
+            else:
+                yield(transcript, hits, 0.0)
+    # }}}
+
+    # {{{ write_matrix_files
+    def write_matrix_files(
+            self, samples, matrix, counts=None, GO_IDs=None, categories=None
+            ):
+
+        """ {{{ Docstrings
+        Writes the cumulative TPM of each GO_ID (row) in each sample
+        (column) to a file per primary GO category, and of every GO_ID to a
+        cumulative file, in the form of:
+
+            GO_id\tSample_One\tSample_Two\n
+            GO_ID\tTPM\tTPM\n
+
+        Given the number of hits, GO_IDs and primary GO category of each
+        row, if other than those of the GO file (e.g. once propagated).
+        }}} """
+
+        if counts is None:
+            counts = self.count_GO_hits()
+        if GO_IDs is None:
+            GO_IDs = self.GO_IDs
+        if categories is None:
+            categories = self.GO_categories()
+        hit = counts > 0
+        for code, name in enumerate(self.IDs):
+            rows = hit if code == len(CATEGORIES) else hit & (
+                    categories == code
+                    )
+            with open(name, 'w') as f:
+                f.write('\t'.join(['GO_id'] + list(samples)) + '\n')
+                for i in np.flatnonzero(rows):
+                    f.write(GO_IDs[i] + '\t' + '\t'.join(
+                            format_TPM(j) for j in matrix[i]
+                            ) + '\n')
+    # }}}
+
+    # {{{ read_foreground_file
+    def read_foreground_file(self, foreground_file):
+
+        """ {{{ Docstrings
+        Reads a foreground file, i.e. one sequence ID per line (the first
+        field thereof), into an array.
+        }}} """
+
+        with open(foreground_file, 'r') as f:
+            return np.array(
+                    [i.split()[0] for i in f if i.strip()], dtype=str
+                    )
+    # }}}
+
+    # {{{ write_enrichment_files
+    def write_enrichment_files(
+            self, GO_IDs, categories, hits, totals, p_values, q_values
+            ):
+
+        """ {{{ Docstrings
+        Writes the enrichment of each GO_ID tested (row) in each foreground
+        (column) to a file per foreground, sorted by p-value, in the form of:
+
+            GO_id\tcategory\tforeground_hits\tforeground_size\t
+            background_hits\tbackground_size\tfold_enrichment\tp_value\t
+            q_value\n
+
+        Where hits and totals are tuples of the number of hits of each GO_ID
+        in each foreground and overall, and the number of sequences of each
+        primary GO category in each foreground and overall, respectively.
+        }}} """
+
+        names = np.array([j for i, j in CATEGORIES])[categories]
+        K, N = hits[1], totals[1][categories]
+        for column, name in enumerate(self.IDs):
+            k = hits[0][:, column]
+            n = totals[0][categories, column]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fold = (k * N) / (n * K.astype(float))
+            rows = np.lexsort((GO_IDs, p_values[:, column]))
+            # Formatted from lists, rather than element by element of arrays
+            columns = [
+                    i[rows].tolist() for i in (
+                            GO_IDs, names, k, n, K, N, fold,
+                            p_values[:, column], q_values[:, column]
+                            )
+                    ]
+            with open(name, 'w') as f:
+                f.write(
+                        'GO_id\tcategory\tforeground_hits\tforeground_size\t'
+                        'background_hits\tbackground_size\tfold_enrichment\t'
+                        'p_value\tq_value\n'
+                        )
+                for i in zip(*columns):
+                    f.write('%s\t%s\t%d\t%d\t%d\t%d\t%.6g\t%.6g\t%.6g\n' % i)
     # }}}
 
     # {{{ write_cum_file
-    def write_cum_file(self, cum_data):
+    def write_cum_file(self, cum_data, counts=None, GO_IDs=None):
 
         """ {{{ Docstrings
-        Writes the cumulative GO/TPM data to file.
+        Writes the cumulative GO/TPM data to file, i.e. that of every GO_ID
+        of a primary GO category with at least one hit, given the number of
+        hits of each GO_ID, if already counted, and the GO_IDs, if other than
+        those of the GO file (e.g. once propagated).
         }}} """
 
+        if counts is None:
+            counts = self.count_GO_hits()
+        if GO_IDs is None:
+            GO_IDs = self.GO_IDs
         with open(self.IDs[3], 'w') as cum:
             cum.write('GO_id\tCumulative_TPM\n')
-            for k, v in cum_data.iteritems():
-                cum.write(k + '\t' + str(v) + '\n')
+            for i in np.flatnonzero(counts > 0):
+                cum.write(GO_IDs[i] + '\t' + format_TPM(cum_data[i]) + '\n')
     # }}}
 # }}}
 
@@ -106,180 +318,435 @@ class DataParse(FileIO):
 
     Namely:
 
-        1.) A GO dictionary is constructed in the form of:
+        1.) Sequence IDs and GO hits (GO:GO_ID^category^name) are interned
+            as integer codes, each distinct GO hit being parsed only once,
+            and the incidence of GO hits is stored as two compact arrays in
+            the form of:
 
-                dictionary = {
-                        'Seq_ID' : [
-                                'GO:GO_ID^GO^data',
-                                'GO:GO_ID^GO^data'
-                                ]
-                        }
-            Alternatively, a TPM dictionary is constructed in the form of:
+                hit_transcripts = [Seq_ID code, Seq_ID code, ...]
+                hit_codes = [GO hit code, GO hit code, ...]
 
-                dictionary = {'Seq_ID' : TPM}
+            With one element per GO hit of each sequence, in the order of the
+            GO file. The primary GO category and GO_ID of each distinct GO
+            hit are stored as arrays indexed by GO hit code, and the order
+            in which the sequence IDs sort (transcript_order) is computed
+            once, for every lookup of sequence IDs thereafter.
 
-        2.) Utilizing this dictionary, the values are filtered to construct
-            novel dictionaries categorized by the primary GO category
-            (cellular component, biological process, or molecular function).
-            i.e. only GO hits corresponding to the pertinent primary GO
-            category are included.
+        2.) The TPM value of each sequence is stored as an array indexed by
+            Seq_ID code, sequences absent from the TPM file being assigned 0.
 
-        3.) A concatenated GO/TPM dictionary is constructed in the form of:
+        3.) The TPM value of each sequence is divided by the number of hits
+            for the corresponding sequence for that primary GO category.
 
-                dictionary = {
-                        'Seq_ID' : [
-                                'GO:GO_ID^GO^data:TPM',
-                                'GO:GO_ID^GO^data:TPM'
-                                ]
-                        }
+        4.) A cumulative TPM array is constructed with a single weighted
+            bincount, in which the value of cumulative TPM is the sum off all
+            divided TPM values across all primary GO categories for that
+            corresponding GO_ID.
 
-            Where the TPM value is the original TPM value divided by the number
-            of hits for the corresponding sequence for that primary GO
-            category.
+    }}} """
 
-        4.) See 5.
+    # {{{ build_GO_arrays
+    def build_GO_arrays(self, GO_file):
 
-        5.) A novel concatenated GO/TPM dictionary is constructed in the form
-            of:
+        """ {{{ Docstrings
+        Reads the GO file into integer coded arrays (see above), in a single
+        pass.
+        }}} """
 
-                dictionary = {'GO_ID' : cumulative TPM}
+        transcripts = []
+        # Code of each distinct GO hit, keyed by its unparsed string
+        codes = {}
+        hit_transcripts = array('i')
+        hit_codes = array('i')
+        for transcript, hits in self.read_GO_TPM_file(GO_file):
+            hits = [i for i in hits.split('`') if i.startswith('GO:')]
+            if not hits:
+                continue
+            hit_transcripts.extend([len(transcripts)] * len(hits))
+            transcripts.append(transcript)
+            for i in hits:
+                hit_codes.append(codes.setdefault(i, len(codes)))
+        GO_hits = [None] * len(codes)
+        for i, j in codes.iteritems():
+            GO_hits[j] = i
+        self.transcripts = np.array(transcripts, dtype=str)
+        # Sorted once, for every subsequent lookup of sequence IDs
+        self.transcript_order = np.argsort(self.transcripts)
+        self.hit_transcripts = np.frombuffer(hit_transcripts, dtype=np.intc)
+        self.hit_codes = np.frombuffer(hit_codes, dtype=np.intc)
+        self.set_GO_hits(GO_hits)
+    # }}}
 
-            Where the value of cumulative TPM is the sum off all TPM values
-            across all primary GO categories for that corresponding GO_ID.
+    # {{{ load_GO_arrays
+    def load_GO_arrays(self, GO_file, cache=True, gene_IDs=None):
 
-    }}} """
+        """ {{{ Docstrings
+        As build_GO_arrays, loading the arrays from the cache of the GO file
+        instead, if valid, else writing them thereto. Sequences are then
+        rolled up into genes, given a function returning the gene ID of each
+        of an array of sequence IDs (see rollup_genes).
+        }}} """
+
+        if not (cache and self.read_GO_cache(GO_file)):
+            self.build_GO_arrays(GO_file)
+            if cache:
+                self.write_GO_cache(GO_file)
+        if gene_IDs is not None:
+            self.rollup_genes(gene_IDs)
+    # }}}
 
-    # {{{ build_GO_TPM_dict
-    def build_GO_TPM_dict(self, GO_TPM_file_list, Is_GO):
+    # {{{ rollup_genes
+    def rollup_genes(self, gene_IDs):
 
         """ {{{ Docstrings
-        Constructs dictionary, seperating sequence IDs from data.
+        Rolls the sequences of the GO file up into genes, given a function
+        returning the gene ID of each of an array of sequence IDs (e.g.
+        trinity_genes), such that Seq_ID codes thereafter code genes (in
+        sorted order), each with the union of the GO hits of its sequences.
         }}} """
 
-        f = map(lambda x: x.split('\t'), GO_TPM_file_list)
-        if Is_GO:
-            go_dict = dict((i[0], i[1].split('`')) for i in f)
-            return go_dict
-        else:
-            tpm_dict = dict((i[0], int(i[1])) for i in f)
-            return tpm_dict
+        genes, codes = np.unique(
+                gene_IDs(self.transcripts), return_inverse=True
+                )
+        # Distinct pairs of gene and GO hit, grouped by gene
+        n = max(len(self.GO_hits), 1)
+        keys = np.unique(
+                codes[self.hit_transcripts].astype(np.int64) * n +
+                self.hit_codes
+                )
+        self.transcripts = genes
+        # np.unique returns genes sorted
+        self.transcript_order = np.arange(len(genes))
+        self.hit_transcripts = (keys // n).astype(np.intc)
+        self.hit_codes = (keys % n).astype(np.intc)
     # }}}
 
-    # {{{ filter_GO_dict
-    def filter_GO_dict(self, GO_dict, *GO_category):
+    # {{{ set_GO_hits
+    def set_GO_hits(self, GO_hits):
 
         """ {{{ Docstrings
-        Filters GO data based on the primary GO category.
+        Parses each distinct GO hit once, storing the primary GO category
+        (-1 if none) and the code of the GO_ID of each, the GO_IDs being
+        sorted.
         }}} """
 
-        dictionary = {}
-        for i in GO_category:
-            tmp_dict = {}
-            for k, v in GO_dict.iteritems():
-                tmp_value = filter(lambda x: i in x, v)
-                if tmp_value:
-                    tmp_dict[k] = tmp_value
-            dictionary[i] = tmp_dict
-                # {{{ return empty
-                # uncomment this block of code if you would like script to
-                # print 'empty' in gene_ontology column if no GO hits in
-                # pertinent GO category
-                # else:
-                #     dictionary[k] = 'empty'
-                # }}}
-        return(
-                dictionary['cellular_component'],
-                dictionary['biological_process'],
-                dictionary['molecular_function']
+        records = [i.split('^', 2) for i in GO_hits]
+        self.GO_hits = list(GO_hits)
+        self.hit_categories = np.array([
+                CATEGORY_CODES.get(i[1], -1) if len(i) > 1 else -1
+                for i in records
+                ], dtype=np.int8)
+        self.GO_IDs, self.hit_GO_IDs = np.unique(
+                np.array([i[0][3:] for i in records], dtype=str),
+                return_inverse=True
                 )
-        # }}}
+    # }}}
 
-    # {{{ concatenate_GO_TPM_data
-    def concatenate_GO_TPM_data(self, TPM_dict, *filtered_GO_dicts):
+    # {{{ build_TPM_array
+    def build_TPM_array(self, TPM_file, gene_IDs=None):
 
         """ {{{ Docstrings
-        Concatenates GO and TPM for subsequent writing to file.
+        Reads the TPM file into an array indexed by Seq_ID code, looking up
+        every sequence ID at once. Given a function returning the gene ID of
+        each of an array of sequence IDs (see rollup_genes), the TPM values
+        of every sequence of a gene are summed instead, with a single
+        weighted bincount.
         }}} """
 
-        dictionary = {}
-        for i in filtered_GO_dicts:
-            tmp_dict = {}
-            for k, v in i.iteritems():
-                tmp_dict[k] = map(
-                        lambda x: x + ':{0}'.format(TPM_dict[k] / len(v)), v
-                        )
-            if i == go_cc:
-                dictionary['go_tpm_cc'] = tmp_dict
-            elif i == go_bp:
-                dictionary['go_tpm_bp'] = tmp_dict
-            else:
-                dictionary['go_tpm_mf'] = tmp_dict
+        IDs = []
+        tpm = []
+        for i, j in self.read_GO_TPM_file(TPM_file):
+            IDs.append(i)
+            tpm.append(j)
+        IDs = np.array(IDs, dtype=str)
+        tpm = np.array(tpm, float)
+        if gene_IDs is not None and len(IDs):
+            IDs, codes = np.unique(gene_IDs(IDs), return_inverse=True)
+            tpm = np.bincount(codes, weights=tpm, minlength=len(IDs))
+        return self.align_TPM(IDs, tpm)
+    # }}}
+
+    # {{{ align_TPM
+    def align_TPM(self, IDs, tpm):
+
+        """ {{{ Docstrings
+        Given an array of sequence IDs and an array of their TPM values,
+        returns an array of TPM values indexed by Seq_ID code, via a binary
+        search of the sorted sequence IDs.
+        }}} """
+
+        tpm_array = np.zeros(len(self.transcripts))
+        codes = self.transcript_codes(IDs)
+        found = codes >= 0
+        tpm_array[codes[found]] = tpm[found]
+        return tpm_array
+    # }}}
+
+    # {{{ transcript_codes
+    def transcript_codes(self, IDs):
+
+        """ {{{ Docstrings
+        Returns the Seq_ID code of each of an array of sequence IDs, -1 if
+        absent from the GO file, via a binary search of the sorted sequence
+        IDs (see transcript_order).
+        }}} """
+
+        codes = np.full(len(IDs), -1, dtype=np.intp)
+        if not len(self.transcripts) or not len(IDs):
+            return codes
+        order = self.transcript_order
+        position = np.searchsorted(self.transcripts, IDs, sorter=order)
+        found = order[np.minimum(position, len(order) - 1)]
+        matched = self.transcripts[found] == IDs
+        codes[matched] = found[matched]
+        return codes
+    # }}}
+
+    # {{{ stream_GO_TPM
+    def stream_GO_TPM(self, GO_file, TPM_file, category_files=()):
+
+        """ {{{ Docstrings
+        Streams a GO file and TPM file, sorted by sequence ID, through
+        merge_GO_TPM, dividing the TPM value of each sequence between its
+        hits for each primary GO category and accumulating the cumulative TPM
+        and number of hits of each distinct GO hit as it goes, writing the
+        divided TPM values to the file of each category, if given. Only the
+        distinct GO hits are held in memory, rather than every sequence.
+        Returns arrays of the cumulative TPM and number of hits of each
+        GO_ID.
+        }}} """
+
+        # Code of each distinct GO hit, keyed by its unparsed string
+        codes = {}
+        GO_hits = []
+        categories = []
+        cum_data = []
+        counts = []
+        for transcript, hits, tpm in self.merge_GO_TPM(GO_file, TPM_file):
+            buckets = [[] for i in CATEGORIES]
+            for i in hits.split('`'):
+                if not i.startswith('GO:'):
+                    continue
+                code = codes.get(i)
+                if code is None:
+                    code = codes[i] = len(GO_hits)
+                    GO_hits.append(i)
+                    i = i.split('^', 2)
+                    categories.append(
+                            CATEGORY_CODES.get(i[1], -1) if len(i) > 1 else -1
+                            )
+                    cum_data.append(0.0)
+                    counts.append(0)
+                if categories[code] >= 0:
+                    buckets[categories[code]].append(code)
+            for category, bucket in enumerate(buckets):
+                if not bucket:
+                    continue
+                share = tpm / len(bucket)
+                for code in bucket:
+                    cum_data[code] += share
+                    counts[code] += 1
+                if category_files:
+                    category_files[category].write(self.format_category_line(
+                            transcript, [GO_hits[i] for i in bucket], share
+                            ))
+        self.set_GO_hits(GO_hits)
         return(
-                dictionary['go_tpm_cc'], dictionary['go_tpm_bp'],
-                dictionary['go_tpm_mf']
+                np.bincount(
+                        self.hit_GO_IDs, weights=cum_data,
+                        minlength=len(self.GO_IDs)
+                        ),
+                np.bincount(
+                        self.hit_GO_IDs, weights=counts,
+                        minlength=len(self.GO_IDs)
+                        )
                 )
     # }}}
 
-    # {{{ prep_cum_data
-    def prep_cum_data(self, list_of_concat_files):
+    # {{{ build_hit_weights
+    def build_hit_weights(self):
 
         """ {{{ Docstrings
-        Filters and further concatenates files for subsequent parsing.
+        Returns the fraction of the TPM value of its sequence received by
+        each GO hit, i.e. 1 divided by the number of hits for that sequence
+        for that primary GO category. Hits of no primary GO category receive
+        none. The fractions are independent of the TPM values, such that they
+        may be computed once and reused for any number of samples.
         }}} """
 
-        cf = ''.join(list_of_concat_files)
-        cf = cf.replace('\n', '\t')
-        cf = cf.split('\t')
-        cf = filter(lambda x: 'GO:' in x, cf)
-        return cf
+        categories = self.hit_categories[self.hit_codes]
+        valid = categories >= 0
+        # Key of each hit, unique to its sequence and primary GO category
+        keys = self.hit_transcripts * len(CATEGORIES) + categories
+        counts = np.bincount(
+                keys[valid], minlength=len(CATEGORIES) * len(self.transcripts)
+                )
+        weights = np.zeros(len(keys))
+        weights[valid] = 1.0 / counts[keys[valid]]
+        return weights
     # }}}
 
-    # {{{ build_cum_dict
-    def build_cum_dict(self, prepped_cum_data):
+    # {{{ split_TPM
+    def split_TPM(self, tpm, weights=None):
 
         """ {{{ Docstrings
-        Utilizing re module, extracts pertinent data and constructs
-        dictionary.
+        Returns the share of TPM of each GO hit, i.e. the TPM value of its
+        sequence divided by the number of hits for that sequence for that
+        primary GO category (see build_hit_weights).
         }}} """
 
-        dictionary = {}
-        match_objects = map(
-                lambda x: search('GO:(\d+).*:(\d+)', x), prepped_cum_data
+        if weights is None:
+            weights = self.build_hit_weights()
+        return tpm[self.hit_transcripts] * weights
+    # }}}
+
+    # {{{ GO_categories
+    def GO_categories(self):
+
+        """ {{{ Docstrings
+        Returns the primary GO category code of each GO_ID (-1 if none).
+        }}} """
+
+        categories = np.full(len(self.GO_IDs), -1, dtype=np.int8)
+        categories[self.hit_GO_IDs] = self.hit_categories
+        return categories
+    # }}}
+
+    # {{{ count_GO_hits
+    def count_GO_hits(self):
+
+        """ {{{ Docstrings
+        Returns the number of hits of each GO_ID of a primary GO category.
+        }}} """
+
+        valid = self.hit_categories[self.hit_codes] >= 0
+        return np.bincount(
+                self.hit_GO_IDs[self.hit_codes[valid]],
+                minlength=len(self.GO_IDs)
+                )
+    # }}}
+
+    # {{{ GO_incidence
+    def GO_incidence(self):
+
+        """ {{{ Docstrings
+        Returns a tuple of arrays of the Seq_ID code and GO_ID code of every
+        distinct pair of sequence and GO_ID of a primary GO category, in the
+        form of:
+
+            (Seq_ID codes, GO_ID codes)
+
+        }}} """
+
+        valid = self.hit_categories[self.hit_codes] >= 0
+        keys = np.unique(
+                self.hit_transcripts[valid].astype(np.int64) *
+                len(self.GO_IDs) + self.hit_GO_IDs[self.hit_codes[valid]]
+                )
+        return(keys // len(self.GO_IDs), keys % len(self.GO_IDs))
+    # }}}
+
+    # {{{ build_cum_array
+    def build_cum_array(self, shares):
+
+        """ {{{ Docstrings
+        Sums the shares of TPM of every GO hit by GO_ID.
+        }}} """
+
+        return np.bincount(
+                self.hit_GO_IDs[self.hit_codes], weights=shares,
+                minlength=len(self.GO_IDs)
                 )
-        for i in match_objects:
-            if not dictionary.get(i.group(1), False):
-                dictionary[i.group(1)] = int(i.group(2))
-            else:
-                dictionary[i.group(1)] = (
-                        dictionary[i.group(1)] + int(i.group(2))
-                        )
-        return dictionary
     # }}}
 # }}}
 
 
-# {{{ IterRegistry metaclass
-class IterRegistry(type):
+# {{{ read_gene_map
+def read_gene_map(gene_map_file):
 
     """ {{{ Docstrings
-    A metaclass allowing for iterations over instances of the GO_TPM class.
+    Reads a gene map file, i.e. a gene ID and sequence ID per line, as in
+    the "gene_trans_map" file of Trinity, in the form of:
+
+        gene_ID\tSeq_ID\n
+
+    Into a tuple of arrays in the form of:
+
+        (Seq_IDs, gene_IDs)
+
+    Sorted by sequence ID. Exits if malformed.
     }}} """
 
-    # {{{ __iter__
-    def __iter__(cls):
-        return iter(cls.registry)
-    # }}}
+    with open(gene_map_file, 'r') as f:
+        fields = f.read().split()
+    if len(fields) % 2:
+        exit(
+                'Gene map file {0} is malformed. Try again.'.format(
+                        gene_map_file
+                        )
+                )
+    fields = np.array(fields, dtype=str).reshape(-1, 2)
+    order = np.argsort(fields[:, 1], kind='mergesort')
+    return(fields[order, 1], fields[order, 0])
+# }}}
+
+
+# {{{ map_genes
+def map_genes(transcripts, genes, IDs):
+
+    """ {{{ Docstrings
+    Returns the gene ID of each of an array of sequence IDs, given the sorted
+    arrays returned by read_gene_map. Sequences absent therefrom are their
+    own gene.
+    }}} """
+
+    IDs = np.asarray(IDs, dtype=str)
+    if not len(transcripts) or not len(IDs):
+        return IDs
+    position = np.minimum(np.searchsorted(transcripts, IDs), len(genes) - 1)
+    return np.where(transcripts[position] == IDs, genes[position], IDs)
+# }}}
+
+
+# {{{ trinity_genes
+def trinity_genes(IDs):
+
+    """ {{{ Docstrings
+    Returns the gene ID of each of an array of Trinity sequence IDs, i.e.
+    the sequence ID sans isoform suffix, e.g. comp3_c0 of comp3_c0_seq2 (or
+    TRINITY_DN3_c0_g1 of TRINITY_DN3_c0_g1_i2). Sequences without an isoform
+    suffix are their own gene.
+    }}} """
+
+    IDs = np.asarray(IDs, dtype=str)
+    if not len(IDs):
+        return IDs
+    parts = np.char.rpartition(IDs, '_')
+    # Isoform suffix sans number, e.g. "seq" of "seq2"
+    prefix = np.char.rstrip(parts[:, 2], '0123456789')
+    isoform = (
+            (parts[:, 0] != '') & ((prefix == 'seq') | (prefix == 'i')) &
+            (np.char.str_len(prefix) < np.char.str_len(parts[:, 2]))
+            )
+    return np.where(isoform, parts[:, 0], IDs)
+# }}}
+
+
+# {{{ format_TPM
+def format_TPM(tpm):
+
+    """ {{{ Docstrings
+    Formats a TPM value, omitting trailing zeros (and the decimal point of
+    whole numbers).
+    }}} """
+
+    return '{0:.6f}'.format(tpm).rstrip('0').rstrip('.')
 # }}}
 
 
 # {{{ # GO_TPM class
 class GO_TPM(DataParse):
 
-    # {{{ __metaclass__
-    __metaclass__ = IterRegistry
-    registry = []
-    # }}}
-
     """ {{{ Docstrings
     A class in which all pertinent data and parameters correspnding to
     each each Seq and their respective GO and TMP files are stored.
@@ -287,11 +754,154 @@ class GO_TPM(DataParse):
 
     # {{{ __init__
     def __init__(self, seq, GO_file, TPM_file):
-        self.go, self.tpm = self.read_GO_TPM_file(GO_file, TPM_file)
-        self.IDs = (
-                '{0}_CC{1},{0}_BP{1},{0}_MF{1},{0}_CUM{1}'.format(seq, '.txt')
-                ).split(',')
-        self.registry.append(self)
+        self.GO_file = GO_file
+        self.TPM_file = TPM_file
+        self.IDs = [
+                '{0}_{1}.txt'.format(seq, i)
+                for i in [j for k, j in CATEGORIES] + ['CUM']
+                ]
+    # }}}
+# }}}
+
+
+# {{{ GO_TPM_Matrix class
+class GO_TPM_Matrix(DataParse):
+
+    """ {{{ Docstrings
+    A class in which all pertinent data and parameters corresponding to a
+    single GO file shared by any number of samples, and the TPM file of each
+    sample, are stored.
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, name, GO_file, TPM_files):
+        self.GO_file = GO_file
+        self.TPM_files = list(TPM_files)
+        self.samples = [file_stem(i, ('_TPM',)) for i in self.TPM_files]
+        self.IDs = [
+                '{0}_{1}_matrix.txt'.format(name, i)
+                for i in [j for k, j in CATEGORIES] + ['CUM']
+                ]
+    # }}}
+
+    # {{{ build_matrix
+    def build_matrix(self, cache=True, gene_IDs=None):
+
+        """ {{{ Docstrings
+        Parses the GO file once (or loads it from its cache) and streams each
+        TPM file against it, returning a matrix of the cumulative TPM of each
+        GO_ID (row) in each sample (column). Work per sample is a single
+        weighted bincount of that sample's TPM values. Sequences are rolled
+        up into genes, given gene_IDs (see rollup_genes).
+        }}} """
+
+        self.load_GO_arrays(self.GO_file, cache, gene_IDs)
+        weights = self.build_hit_weights()
+        GO_IDs = self.hit_GO_IDs[self.hit_codes]
+        matrix = np.zeros((len(self.GO_IDs), len(self.TPM_files)))
+        for column, TPM_file in enumerate(self.TPM_files):
+            tpm = self.build_TPM_array(TPM_file, gene_IDs)
+            matrix[:, column] = np.bincount(
+                    GO_IDs, weights=self.split_TPM(tpm, weights),
+                    minlength=len(self.GO_IDs)
+                    )
+        return matrix
+    # }}}
+# }}}
+
+
+# {{{ GO_Enrichment class
+class GO_Enrichment(DataParse):
+
+    """ {{{ Docstrings
+    A class in which all pertinent data and parameters corresponding to a
+    single GO file, and any number of foreground files (sets of sequences,
+    e.g. those differentially expressed in each contrast) tested for
+    enrichment of each GO_ID, are stored.
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, GO_file, foreground_files):
+        self.GO_file = GO_file
+        self.foreground_files = list(foreground_files)
+        self.IDs = [
+                '{0}_enrichment.txt'.format(splitext(basename(i))[0])
+                for i in self.foreground_files
+                ]
+        if len(set(self.IDs)) != len(self.IDs):
+            exit(
+                    'Foreground files would overwrite one another\'s '
+                    'enrichment file; name them uniquely. Try again.'
+                    )
+    # }}}
+
+    # {{{ test_enrichment
+    def test_enrichment(self, dag=None, cache=True, gene_IDs=None):
+
+        """ {{{ Docstrings
+        Parses the GO file once (or loads it from its cache) and tests every
+        GO_ID for enrichment within every foreground at once, by
+        hypergeometric test, the background being every sequence with at
+        least one hit of the same primary GO category. Hits are propagated to
+        the ancestors of each GO_ID, given a GODag, and sequences (including
+        those of each foreground) are rolled up into genes, given gene_IDs
+        (see rollup_genes). Foreground counts are a
+        single weighted bincount per foreground and p-values are adjusted by
+        Benjamini-Hochberg per primary GO category and foreground. Returns a
+        tuple in the form of:
+
+            (GO_IDs, categories, hits, totals, p_values, q_values)
+
+        See write_enrichment_files.
+        }}} """
+
+        self.load_GO_arrays(self.GO_file, cache, gene_IDs)
+        rows, columns = self.GO_incidence()
+        GO_IDs, categories = self.GO_IDs, self.GO_categories()
+        if dag is not None:
+            GO_IDs, categories, rows, columns = dag.propagate_pairs(
+                    GO_IDs, categories, rows, columns
+                    )
+        # Sequences of each foreground, looked up at once
+        IDs = map(self.read_foreground_file, self.foreground_files)
+        codes = np.concatenate(IDs)
+        if gene_IDs is not None:
+            codes = gene_IDs(codes)
+        codes = self.transcript_codes(codes)
+        foreground_codes = np.repeat(np.arange(len(IDs)), map(len, IDs))
+        found = codes >= 0
+        foreground = np.zeros((len(self.transcripts), len(IDs)), bool)
+        foreground[codes[found], foreground_codes[found]] = True
+        # Sequences of each primary GO category, i.e. the background
+        background = np.zeros((len(self.transcripts), len(CATEGORIES)), bool)
+        valid = categories[columns] >= 0
+        background[rows[valid], categories[columns[valid]]] = True
+        totals = (
+                np.dot(background.T.astype(np.int64), foreground),
+                background.sum(axis=0)
+                )
+        hits = (
+                np.column_stack([
+                        np.bincount(
+                                columns, weights=foreground[rows, i],
+                                minlength=len(GO_IDs)
+                                ).astype(np.int64)
+                        for i in range(foreground.shape[1])
+                        ]),
+                np.bincount(columns, minlength=len(GO_IDs))
+                )
+        tested = (hits[1] > 0) & (categories >= 0)
+        GO_IDs, categories = GO_IDs[tested], categories[tested]
+        hits = (hits[0][tested], hits[1][tested])
+        p_values = hypergeometric_sf(
+                hits[0], hits[1][:, None], totals[0][categories],
+                totals[1][categories, None]
+                )
+        q_values = np.empty_like(p_values)
+        for code in range(len(CATEGORIES)):
+            selected = categories == code
+            q_values[selected] = benjamini_hochberg(p_values[selected])
+        return(GO_IDs, categories, hits, totals, p_values, q_values)
     # }}}
 # }}}
 
@@ -315,8 +925,11 @@ arg_parser.add_argument(
         default='None'
         )
 arg_parser.add_argument(
-        '-TPM', type=str, help='Name of TPM file to be concatenated.',
-        default='None'
+        '-TPM', type=str, nargs='+', help=(
+                'Name of TPM file to be concatenated (or, with -M/--matrix, '
+                'of the TPM file of each sample).'
+                ),
+        default=['None']
         )
 arg_parser.add_argument(
         '-b', '--batch', help=(
@@ -325,37 +938,193 @@ arg_parser.add_argument(
                 ),
         action='store_true'
         )
+arg_parser.add_argument(
+        '-c', '--categories', help=(
+                'Additionally write the concatenated GO/TPM data of each '
+                'primary GO category to "_CC.txt", "_BP.txt" and "_MF.txt" '
+                'files.'
+                ),
+        action='store_true'
+        )
+arg_parser.add_argument(
+        '-s', '--sorted', help=(
+                'GO and TPM files are sorted by transcript ID (in byte order, '
+                'e.g. by "LC_ALL=C sort"); merge-join them line by line, such '
+                'that memory depends on the number of distinct GO terms, '
+                'rather than the number of transcripts.'
+                ),
+        action='store_true'
+        )
+arg_parser.add_argument(
+        '-P', '--propagate', type=str, metavar='OBO', help=(
+                'Propagate the cumulative TPM of each GO ID to all of its '
+                'ancestors (by is_a and part_of) in the given OBO file, e.g. '
+                'go-basic.obo, each ancestor receiving the sum of that of its '
+                'descendants, each counted once. The ancestors of every GO '
+                'term are cached alongside the OBO file, i.e. ".obo.npz".'
+                ),
+        default=None
+        )
+arg_parser.add_argument(
+        '--no-cache', help=(
+                'Neither read nor write the cache of each parsed GO file, '
+                'i.e. "_GO.txt.npz", nor that of the OBO file (-P).'
+                ),
+        action='store_true'
+        )
+arg_parser.add_argument(
+        '-g', '--genes', type=str, nargs='?', metavar='MAP', help=(
+                'Roll transcripts up into genes, summing the TPM and taking '
+                'the union of the GO hits of every transcript of a gene, '
+                'prior to dividing TPM between GO hits. Genes are given by a '
+                'gene map file, i.e. a gene ID and transcript ID per line, as '
+                'in the "gene_trans_map" file of Trinity, or else by the '
+                'Trinity transcript ID sans isoform suffix, e.g. comp3_c0 of '
+                'comp3_c0_seq2.'
+                ),
+        const=True, default=None
+        )
+arg_parser.add_argument(
+        '-M', '--matrix', type=str, metavar='NAME', help=(
+                'Parse the GO file (-GO) once and write the cumulative TPM of '
+                'each GO ID in every sample, i.e. each TPM file given (-TPM) '
+                'or, in batch mode, each "_TPM.txt" file in the directory, to '
+                'a GO ID x sample matrix per primary GO category '
+                '("NAME_CC_matrix.txt", etc.) and a cumulative matrix '
+                '("NAME_CUM_matrix.txt").'
+                ),
+        default=None
+        )
+arg_parser.add_argument(
+        '-E', '--enrichment', type=str, nargs='+', metavar='FOREGROUND',
+        help=(
+                'Test every GO ID of the GO file (-GO) for enrichment within '
+                'each given foreground file, i.e. one transcript ID per line '
+                '(e.g. those differentially expressed in a contrast), by '
+                'hypergeometric test against every transcript with hits of '
+                'the same primary GO category, with Benjamini-Hochberg '
+                'correction, writing "FOREGROUND_enrichment.txt" for each. '
+                'Hits are propagated to ancestors with -P/--propagate.'
+                ),
+        default=None
+        )
+arg_parser.add_argument(
+        '-j', '--jobs', type=int, help=(
+                'Number of GO/TPM file pairs to run at once in batch mode; 0 '
+                'utilizes every core.'
+                ),
+        default=1
+        )
 args = arg_parser.parse_args()
 # }}}
 
 
-# {{{ Batch
-if args.batch:
-    cwd = getcwd()
-    fid = listdir(cwd)
-    GO_files = sorted(filter(lambda x: '_GO.txt' in x, fid))
-    TPM_files = sorted(filter(lambda x: '_TPM.txt' in x, fid))
-    for i, j in zip(GO_files, TPM_files):
-        GO_TPM(i.replace('_GO.txt', ''), i, j)
-else:
-    GO_TPM(args.GO, args.TPM)
+# {{{ Run
+def run(seq, GO_file, TPM_file):
+    data = GO_TPM(seq, GO_file, TPM_file)
+    if args.sorted:
+        category_files = data.open_category_files() if args.categories else ()
+        try:
+            cum_data, counts = data.stream_GO_TPM(
+                    data.GO_file, data.TPM_file, category_files
+                    )
+        except ValueError as e:
+            exit(str(e))
+        finally:
+            for f in category_files:
+                f.close()
+    else:
+        data.load_GO_arrays(data.GO_file, not args.no_cache, gene_IDs)
+        shares = data.split_TPM(
+                data.build_TPM_array(data.TPM_file, gene_IDs)
+                )
+        if args.categories:
+            data.write_concat_GO_dicts(shares)
+        cum_data = data.build_cum_array(shares)
+        counts = data.count_GO_hits()
+    if dag is None:
+        data.write_cum_file(cum_data, counts)
+    else:
+        GO_IDs, categories, cum_data, counts = dag.propagate(
+                data.GO_IDs, data.GO_categories(), cum_data, counts
+                )
+        data.write_cum_file(cum_data, counts, GO_IDs)
 # }}}
 
 
-# {{{ Run
-for data in GO_TPM:
-    go = data.build_GO_TPM_dict(data.go, True)
-    tpm = data.build_GO_TPM_dict(data.tpm, False)
-    go_cc, go_bp, go_mf = data.filter_GO_dict(
-            go, 'cellular_component', 'biological_process',
-            'molecular_function'
+# {{{ run_matrix
+def run_matrix(name, GO_file, TPM_files):
+    data = GO_TPM_Matrix(name, GO_file, TPM_files)
+    matrix = data.build_matrix(not args.no_cache, gene_IDs)
+    if dag is None:
+        data.write_matrix_files(data.samples, matrix)
+    else:
+        GO_IDs, categories, matrix, counts = dag.propagate(
+                data.GO_IDs, data.GO_categories(), matrix,
+                data.count_GO_hits()
+                )
+        data.write_matrix_files(
+                data.samples, matrix, counts, GO_IDs, categories
+                )
+# }}}
+
+
+# {{{ run_enrichment
+def run_enrichment(GO_file, foreground_files):
+    data = GO_Enrichment(GO_file, foreground_files)
+    data.write_enrichment_files(
+            *data.test_enrichment(dag, not args.no_cache, gene_IDs)
+            )
+# }}}
+
+
+# {{{ Batch
+if args.genes and args.sorted:
+    exit(
+            'Genes (-g/--genes) cannot be rolled up in sorted mode '
+            '(-s/--sorted). Try again.'
             )
-    go_tpm_cc, go_tpm_bp, go_tpm_mf = data.concatenate_GO_TPM_data(
-            tpm, go_cc, go_bp, go_mf
+gene_IDs = None
+if args.genes is True:
+    gene_IDs = trinity_genes
+elif args.genes:
+    gene_IDs = partial(map_genes, *read_gene_map(args.genes))
+dag = None
+if args.propagate:
+    try:
+        dag = GODag(args.propagate, not args.no_cache)
+    except (IOError, ValueError) as e:
+        exit(str(e))
+if args.enrichment:
+    run_enrichment(args.GO, args.enrichment)
+elif args.matrix:
+    TPM_files = args.TPM
+    if args.batch:
+        TPM_files = sorted(
+                filter(lambda x: '_TPM.txt' in x, listdir(getcwd()))
+                )
+    run_matrix(args.matrix, args.GO, TPM_files)
+elif args.batch:
+    cwd = getcwd()
+    fid = listdir(cwd)
+    # Exclude caches of parsed GO files
+    GO_files = filter(
+            lambda x: '_GO.txt' in x and not x.endswith('.npz'), fid
             )
-    data.write_concat_GO_dicts(go_tpm_cc, go_tpm_bp, go_tpm_mf)
-    concat_file_list = data.read_concat_file()
-    prepped_cum_data = data.prep_cum_data(concat_file_list)
-    cum_data = data.build_cum_dict(prepped_cum_data)
-    data.write_cum_file(cum_data)
+    TPM_files = filter(lambda x: '_TPM.txt' in x, fid)
+    suffixes = ('_GO', '_TPM')
+    run_batch(
+            run, [
+                    (file_stem(i, suffixes), i, j)
+                    for i, j in pair_files(GO_files, TPM_files, suffixes)
+                    ],
+            args.jobs
+            )
+else:
+    if len(args.TPM) != 1:
+        exit(
+                'You specified more than one TPM file without a matrix. Try '
+                'again.'
+                )
+    run(file_stem(args.GO, ('_GO',)), args.GO, args.TPM[0])
 # }}}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Position-specific scoring of domain candidates utilized by ShK.py.
+# Requires numpy.
+# }}}
+
+
+# {{{ Imports
+import numpy as np
+# }}}
+
+
+# {{{ PSSM
+class PSSM(object):
+
+    """ {{{ Docstrings
+
+    A class in which a position-specific scoring matrix (e.g. one exported
+    for the SMART SM00254 profile) is stored and with which domain
+    candidates are scored.
+
+    Peptide sequences are encoded as integer arrays, such that the scores of
+    any number of windows may be looked up and summed in a single numpy
+    operation. Residues absent from the matrix (e.g. "X", "*") score 0.
+
+    }}} """
+
+    # {{{ __init__
+    def __init__(self, alphabet, scores):
+        # Number of positions in the matrix
+        self.length = len(scores)
+        # Byte-level lookup table encoding each residue as the index of its
+        # column; any other character is encoded as an extra column of 0s
+        self.encode = np.full(256, len(alphabet), dtype=np.intp)
+        for i, j in enumerate(alphabet):
+            self.encode[ord(j.upper())] = self.encode[ord(j.lower())] = i
+        self.scores = np.zeros((self.length, len(alphabet) + 1))
+        self.scores[:, :-1] = scores
+    # }}}
+
+    # {{{ read_pssm_file
+    @classmethod
+    def read_pssm_file(cls, pssm_file):
+
+        """ {{{ Docstrings
+
+        Reads a PSSM file, in which the first line consisting solely of
+        single letters defines the residue of each column and each
+        subsequent line defines the scores of one position, e.g.
+
+            A  R  N  D ...\n
+            -1 -2 -2 -3 ...\n
+            -1  5  0 -2 ...\n
+
+        Lines may be prefixed by the position and consensus residue, as in
+        the ASCII PSSM output by PSI-BLAST (-out_ascii_pssm), of which only
+        the scores (i.e. not the percentages) are read. Empty lines and lines
+        beginning with "#" preceding the matrix are ignored.
+
+        }}} """
+
+        alphabet = None
+        scores = []
+        with open(pssm_file, 'r') as pssm:
+            for line in pssm:
+                line = line.split()
+                if alphabet is None:
+                    if line and line[0][0] != '#' and all(
+                            len(i) == 1 and i.isalpha() for i in line
+                            ):
+                        # PSI-BLAST repeats the alphabet for the percentages
+                        alphabet = []
+                        for i in line:
+                            if i in alphabet:
+                                break
+                            alphabet.append(i)
+                    continue
+                # Strip position and consensus residue
+                if len(line) > 1 and line[1].isalpha():
+                    line = line[2:]
+                try:
+                    row = [float(i) for i in line[:len(alphabet)]]
+                except ValueError:
+                    row = []
+                # End of matrix
+                if len(row) < len(alphabet):
+                    if scores:
+                        break
+                    continue
+                scores.append(row)
+        if alphabet is None or not scores:
+            raise ValueError('{0}: no scoring matrix found'.format(pssm_file))
+        return cls(alphabet, scores)
+    # }}}
+
+    # {{{ score_spans
+    def score_spans(self, spans):
+
+        """ {{{ Docstrings
+
+        Scores a batch of domain candidates, given a list of tuples in the
+        form of:
+
+            [('peptide', start, end), ('peptide', start, end)]
+
+        Where start and end are the zero-based, end exclusive, coordinates of
+        the candidate within the peptide sequence. The score of a candidate
+        is that of the best-scoring window of the length of the matrix which
+        either contains the candidate in its entirety or, if the candidate is
+        longer than the matrix, lies within it; sequences are padded with
+        unscored residues where necessary. Returns a numpy array of scores.
+
+        }}} """
+
+        if not spans:
+            return np.zeros(0)
+        length = self.length
+        regions = []
+        # Window starts, relative to their region, and number of windows of
+        # each candidate
+        starts = []
+        counts = []
+        offset = 0
+        for seq, start, end in spans:
+            first = min(start, end - length)
+            last = max(start, end - length)
+            # Region spanned by every window of the candidate, padded with
+            # spaces (unscored) beyond the ends of the sequence
+            lo = first
+            hi = last + length
+            region = (
+                    ' ' * max(0, -lo) + seq[max(0, lo):hi] +
+                    ' ' * max(0, hi - len(seq))
+                    )
+            regions.append(region)
+            starts.append(np.arange(last - first + 1) + offset)
+            counts.append(last - first + 1)
+            offset += len(region)
+        codes = self.encode[np.frombuffer(''.join(regions), dtype=np.uint8)]
+        starts = np.concatenate(starts)
+        # Score of every window, i.e. sum of the score of each residue at
+        # each position of the matrix
+        windows = codes[starts[:, None] + np.arange(length)]
+        window_scores = self.scores[np.arange(length), windows].sum(axis=1)
+        # Best-scoring window of each candidate
+        bounds = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        return np.maximum.reduceat(window_scores, bounds)
+    # }}}
+# }}}
@@ -1,8 +1,12 @@
 # {{{ Imports
 from os import getcwd, listdir
+from os.path import splitext
 from string import maketrans
 from re import search, sub
 import argparse
+from sys import exit
+from FastaIO import read_fasta, join_header, FastaIndex
+from Batch import pair_files, run_batch
 # }}}
 
 # {{{ ExtractData
@@ -29,16 +33,10 @@ class ExtractData(object):
             sequence ID and that the parameters are stored as a list of
             tuples.
 
-        2.) All pertinent parameters, including sequence ID and sequence, are
-            extracted from the fasta file and stored in a dictionary with the
-            form of:
-
-                dictionary = {
-                        'Seq_ID' : 'sequence'
-                        }
-
-            Also of note, all new line characters (\n) are removed to prevent
-            them from interfering with counting the nucleotides.
+        2.) An offset index of the fasta file (in the samtools faidx, ".fai",
+            format) is built, or if already present, reused, such that only
+            the nucleotides referenced by the TransDecoder output are ever
+            read from the memory mapped fasta file. See FastaIO.FastaIndex.
 
     }}} """
 
@@ -51,7 +49,7 @@ class ExtractData(object):
 
         seq_of_int = {}
         # Peptide sequence information not pertinent
-        pep = filter(lambda x: x[0] == '>', self.pep)
+        pep = (join_header(j[0], j[1]) for j in read_fasta(self.pep))
         for i in pep:
             # Sequence ID, nucleotides, and strand, respectively
             data = search('(\w+):(\d+)-(\d+)\((\+|-)\)', i)
@@ -76,41 +74,15 @@ class ExtractData(object):
         return seq_of_int
     # }}}
 
-    # {{{ extract_params_from_fas
-    def extract_params_from_fas(self):
+    # {{{ index_fas
+    def index_fas(self):
 
         """ {{{ Docstrings
-        Reads fasta file into dictionary. Note: Please ensure fasta file
-        contains no empty lines. Use the command:
-
-            sed '/^$/d/ [file] > [output]
-
+        Returns the offset index of the fasta file, building the ".fai" file
+        only if it is absent or older than the fasta file.
         }}} """
 
-        fasta_dict = {}
-        # Python runs the split function first which generates an empty line
-        # at the beginning
-        fasta = self.fas[1:].split('>')
-        # Use for loop as multiple manipulations of 'i'
-        for i in fasta:
-            # {{{ Modifiable
-            # ::Modifiable::
-            # The first argument in the split function is the character that
-            # separates each sequence ID with its respective sequence. This
-            # character should not be present in the sequence ID itself.
-            # The script assumes that each ID is on a separate line so that
-            # the fasta file looks like:
-            #
-            #       >Seq_ID\n
-            #       sequence\n
-            #       sequence\n ...
-            #
-            # }}}
-            i = i.split('\n', 1)
-            seq_id = i[0].strip()
-            seq = i[1].replace('\n', '')
-            fasta_dict[seq_id] = seq
-        return fasta_dict
+        return FastaIndex(self.fas)
     # }}}
 # }}}
 
@@ -128,7 +100,7 @@ class DataParse(ExtractData):
             is generated.
 
         2.) Data from TransDecoder is used to extract the pertinent nucleotides
-            from the fasta file, and if applicable, the reverse complement of
+            from the fasta index, and if applicable, the reverse complement of
             the sequence is generated (utilizing the previous function), which
             is/are stored in a filtered fasta dictionary in the form of:
 
@@ -142,21 +114,20 @@ class DataParse(ExtractData):
     }}} """
 
     # {{{ rev_compl
-    def rev_compl(params, seq):
+    @staticmethod
+    def rev_compl(strand, seq):
 
         """ {{{ Docstrings
         Returns the reverse complement of a given sequence, if applicable.
         }}} """
 
         # Define variables
-        start, end, strand = params
         tbl = maketrans('ATCG', 'TAGC')
         # If forward strand, do nothing
         if strand == '+':
-            return seq[start:end]
+            return seq
         # If reverse, return reverse complement
         else:
-            seq = seq[start:end]
             # Reverse
             rev_seq = seq[::-1]
             # Reverse complement
@@ -165,7 +136,7 @@ class DataParse(ExtractData):
     # }}}
 
     # {{{ extract_pertinent_seq
-    def extract_pertinent_seq(self, fd, soi):
+    def extract_pertinent_seq(self, fi, soi):
 
         """ {{{ Docstrings
         Returns pertinent sequences, and if applicable, reverse complement of
@@ -176,11 +147,13 @@ class DataParse(ExtractData):
         for i in soi.iteritems():
             # Get sequence ID
             seq_id = i[0]
-            # Get sequence from fasta dictionary
-            seq = fd[i[0]]
-            # Build filtered fasta dictionary
+            # Build filtered fasta dictionary, reading only the start:end
+            # slice of each hit from the fasta index
             ffd[seq_id] = map(
-                    lambda x: DataParse.rev_compl(x, seq), i[1]
+                    lambda x: DataParse.rev_compl(
+                            x[2], fi.fetch(seq_id, x[0], x[1])
+                            ),
+                    i[1]
                     )
         return ffd
     # }}}
@@ -188,7 +161,7 @@ class DataParse(ExtractData):
 
 
 # {{{ FileIO
-class FileIO(ExtractData):
+class FileIO(DataParse):
 
     """ {{{ Docstrings
     A class in which all file input/output functionality is stored.
@@ -237,21 +210,6 @@ class FileIO(ExtractData):
 # }}}
 
 
-# {{{ IterRegistry
-class IterRegistry(type):
-
-    """ {{{
-    A metaclass allowing for iterations over the PepFile and FastaFile
-    class.
-    }}} """
-
-    # {{{ __iter__
-    def __iter__(cls):
-        return iter(cls.registry)
-    # }}}
-# }}}
-
-
 # {{{ PepFastaFile
 class PepFastaFile(FileIO):
 
@@ -260,19 +218,11 @@ class PepFastaFile(FileIO):
     respective peptide file are stored.
     }}} """
 
-    # {{{ __metaclass__
-    __metaclass__ = IterRegistry
-    registry = []
-    # }}}
-
     # {{{ __init__
-    def __init__(self, pep_file, fasta_file):
-        with open(pep_file, 'r') as pep:
-            self.pep = pep.readlines()
-        with open(fasta_file, 'r') as fas:
-            self.fas = fas.read()
-        self.fas_new = fasta_file.replace('.fasta', '_new.fasta')
-        self.registry.append(self)
+    def __init__(self, pep_file, fasta_file, fasta_new=None):
+        self.pep = pep_file
+        self.fas = fasta_file
+        self.fas_new = fasta_new or fasta_file.replace('.fasta', '_new.fasta')
     # }}}
 # }}}
 
@@ -288,7 +238,7 @@ arg_parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
         )
 arg_parser.add_argument(
-        'pep_file', type=str,
+        'pep_file', type=str, nargs='?',
         help=(
                 'Name of TransDecoder output file containing peptide '
                 'sequences of interest.'
@@ -296,12 +246,10 @@ arg_parser.add_argument(
         default=None
         )
 arg_parser.add_argument(
-        'fasta_file', type=str,
+        'fasta_file', type=str, nargs='?',
         help=(
                 'Name of fasta file containing nucleotide sequences of '
-                'interest. See docstrings for extract_params_from_fas and '
-                '\'::Modifiable::\' for notes on the necessary format for '
-                'fasta files.'
+                'interest.'
         ),
         default=None
         )
@@ -314,28 +262,64 @@ arg_parser.add_argument(
                 ),
         action='store_true'
         )
+arg_parser.add_argument(
+        '-j', '--jobs', type=int,
+        help=(
+                'Number of peptide files to run at once in batch mode; 0 '
+                'utilizes every core.'
+                ),
+        default=1
+        )
 args = arg_parser.parse_args()
 # }}}
 
 
+# {{{ Run
+def run(pep_file, fasta_file, fasta_new=None):
+    f = PepFastaFile(pep_file, fasta_file, fasta_new)
+    seqs_of_int = f.extract_params_from_pep()
+    fasta_index = f.index_fas()
+    filt_fasta_dict = f.extract_pertinent_seq(fasta_index, seqs_of_int)
+    fasta_index.close()
+    pretty_dict = f.make_pretty(filt_fasta_dict)
+    f.write_dict(pretty_dict)
+# }}}
+
+
 # {{{ Batch
 if args.batch:
     cwd = getcwd()
     fid = listdir(cwd)
-    pep_files = sorted(filter(lambda x: '.pep.' in x, fid))
-    fasta_files = sorted(filter(lambda x: '.fasta' in x, fid))
-    for i, j in zip(pep_files, fasta_files):
-        PepFastaFile(i, j)
+    pep_files = filter(lambda x: '.pep' in x, fid)
+    # Exclude peptide files, fasta indices (and their stamps) and output of
+    # previous runs
+    fasta_files = filter(
+            lambda x: '.fasta' in x and x not in pep_files and
+            not x.endswith(('.fai', '.stamp')) and '_new.fasta' not in x, fid
+            )
+    # Pair by stem, e.g. "Seq_One.fasta" with TransDecoder output
+    # "Seq_One.fasta.transdecoder.pep" or ShK.py output
+    # "Seq_One.fasta.transdecoder_filtered.pep"
+    pairs = pair_files(pep_files, fasta_files)
+    shared = {}
+    for i, j in pairs:
+        shared[j] = j in shared
+    # Name output after the peptide file where a fasta file is shared, e.g.
+    # "Seq_One.fasta.transdecoder_filtered_new.fasta"
+    run_batch(
+            run, [
+                    (i, j, splitext(i)[0] + '_new.fasta') if shared[j] else (
+                            i, j
+                            )
+                    for i, j in pairs
+                    ],
+            args.jobs
+            )
 else:
-    PepFastaFile(args.pep_file, args.fasta_file)
-# }}}
-
-
-# {{{ Run
-for f in PepFastaFile:
-    seqs_of_int = f.extract_params_from_pep()
-    fasta_dict = f.extract_params_from_fas()
-    filt_fasta_dict = f.extract_pertinent_seq(fasta_dict, seqs_of_int)
-    pretty_dict = f.make_pretty(filt_fasta_dict)
-    f.write_dict(pretty_dict)
+    if not args.pep_file or not args.fasta_file:
+        exit(
+                'You did not specify a pep/fasta file to run nor did you run '
+                'the script in batch mode. Try again.'
+                )
+    run(args.pep_file, args.fasta_file)
 # }}}
@@ -17,6 +17,7 @@ from os import getcwd, listdir
 import re
 import argparse
 from sys import exit
+from Batch import pair_files, run_batch
 # }}}
 
 
@@ -64,11 +65,11 @@ class FileIO(object):
         IDs = {}
         # Open file in read mode
         with open(dict_file, 'r') as dictionary:
-            dictionary = dict_file.readlines()
+            dictionary = dictionary.readlines()
         for line in dictionary:
             # Partition line into two values, based on location of tab "\t"
             # character
-            line = line.split('\t')
+            line = line.rstrip('\r\n').split('\t', 1)
             # Set values for readability
             Substitute_ID = line[0]
             Original_ID = line[1]
@@ -87,7 +88,7 @@ class FileIO(object):
         }}} """
 
         # Open file in write mode
-        with open(self.new_tre_file, 'w') as new_tree_file:
+        with open(self._sub_tree_file, 'w') as new_tree_file:
             # Write to file
             new_tree_file.write(subbed_tree_file)
     # }}}
@@ -117,11 +118,11 @@ class RegEx(FileIO):
         # Compile substitute IDs into pattern re.sub can utilize;  "|" in
         # regular expression speak means "or"
         substitute_ID_pattern = re.compile(
-                '|'.join(self._dict.iterkeys())
+                '|'.join(re.escape(i) for i in self._dict.iterkeys())
                 )
         # Perform substitution
         subbed_tree = substitute_ID_pattern.sub(
-                lambda match: self._dict[re.escape(match.group())], self.tree
+                lambda match: self._dict[match.group()], self._tree
                 )
         return subbed_tree
 # }}}
@@ -141,9 +142,9 @@ class TreFile(RegEx):
     def __init__(self, tree_file, dict_file):
         self._tree = self.read_tree_file(tree_file)
         self._dict = self.read_dict_file(dict_file)
-        self._sub_tree_file = self._tree.replace('.tre', '_subbed.tre')
+        self._sub_tree_file = tree_file.replace('.tre', '_subbed.tre')
         self._subbed_tree = self.substitute()
-        self.write_tree_file()
+        self.write_tree_file(self._subbed_tree)
     # }}}
 # }}}
 
@@ -172,11 +173,11 @@ arg_parser = argparse.ArgumentParser(
             )
         )
 arg_parser.add_argument(
-        'tre_file', type=str, help='Name of tre file to be substituted.',
-        default=None
+        'tre_file', type=str, nargs='?',
+        help='Name of tre file to be substituted.', default=None
         )
 arg_parser.add_argument(
-        'dict_file', type=str,
+        'dict_file', type=str, nargs='?',
         help=(
                 'Name of corresponding dictionary file containing original '
                 'IDs and respective substitute IDs.'
@@ -192,6 +193,14 @@ arg_parser.add_argument(
                 ),
         action='store_true'
         )
+arg_parser.add_argument(
+        '-j', '--jobs', type=int,
+        help=(
+                'Number of tre files to substitute at once in batch mode; 0 '
+                'utilizes every core.'
+                ),
+        default=1
+        )
 args = arg_parser.parse_args()
 # }}}
 
@@ -207,21 +216,23 @@ if args.batch:
     # Filter out tre files
     # NOTE: All tree files you wish to run should contain the string ".tre"
     # and all files within the directory containing this string will be run
-    tre_files = sorted(filter(lambda x: '.tre' in x, fid))
+    # Exclude output of previous runs
+    tre_files = filter(
+            lambda x: '.tre' in x and '_subbed.tre' not in x, fid
+            )
     # Filter out dictionary files
     # NOTE: All dictionary files you wish to run should contain the string
     # ".txt" and all files within the directory containing this string will be
     # run
-    dict_files = sorted(filter(lambda x: '.txt' in x, fid))
+    dict_files = filter(lambda x: '.txt' in x, fid)
     # Instantiate instance of TreFile class for each tree file and its
-    # respective dictionary file found
-    for i, j in zip(tre_files, dict_files):
-        TreFile(i, j)
+    # respective dictionary file found, paired by name, up to jobs at once
+    run_batch(TreFile, pair_files(tre_files, dict_files), args.jobs)
 # Else, utilize user-specifed strings to instantiate single instance of PepFile
 # class
 else:
     # Exit if no proper tree/dictionary file specified.
-    if not args.tree_file or args.dict_file:
+    if not args.tre_file or not args.dict_file:
         exit(
                 'You did not specify a tree/dictionary file to run nor did '
                 'you run the script in batch mode. Try again.'
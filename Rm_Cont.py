@@ -2,6 +2,9 @@
 from os import getcwd, listdir
 import re
 import argparse
+from sys import exit
+from FastaIO import read_fasta, join_header
+from Batch import pair_files, run_batch
 # }}}
 
 
@@ -28,9 +31,10 @@ class RegEx(object):
     # {{{ remove_cont
     def remove_cont(self):
         pattern = self.compile_rm()
-        for i in self.fas:
-            if bool(pattern.match(i)):
-                self.fas.remove(i)
+        for seq_id, description, seq in read_fasta(self.fas):
+            header = join_header(seq_id, description)
+            if not bool(pattern.match(header)):
+                yield(header, seq)
     # }}}
 # }}}
 
@@ -44,26 +48,10 @@ class FileIO(RegEx):
     }}} """
 
     # {{{ write_new_output
-    def write_new_output(self):
-        new_fasta_seq = '>'.join(self.fas)
-        with open(self.new_fasta, 'w') as fas:
-            fas.write('>')
-            fas.write(new_fasta_seq)
-    # }}}
-# }}}
-
-
-# {{{ IterRegistry
-class IterRegistry(type):
-
-    """ {{{ Docstrings
-    A metaclass allowing for iterations over instances of the FastaFile
-    class.
-    }}} """
-
-    # {{{ __iter__
-    def __iter__(cls):
-        return iter(cls.registry)
+    def write_new_output(self, records):
+        with open(self.decont, 'w') as fas:
+            for header, seq in records:
+                fas.write('>{0}\n{1}\n'.format(header, seq))
     # }}}
 # }}}
 
@@ -76,21 +64,13 @@ class FastaFile(FileIO):
     respective fasta file are stored.
     }}} """
 
-    # {{{ __metaclass__
-    __metaclass__ = IterRegistry
-    registry = []
-    # }}}
-
     # {{{ __init__
     def __init__(self, fasta_file, rem_file):
-        with open(fasta_file, 'r') as fas:
-            fas = fas.read()
-            self.fas = (fas[1:]).split('>')
+        self.fas = fasta_file
         # TODO: What sort of files am I working with here?
         self.decont = fasta_file.replace('.fasta', '_new.fasta')
         with open(rem_file, 'r') as rem:
             self.rm = rem.readlines()
-        self.registry.append(self)
     # }}}
 # }}}
 
@@ -106,7 +86,7 @@ arg_parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter
         )
 arg_parser.add_argument(
-        'cont_file', type=str,
+        'cont_file', type=str, nargs='?',
         help=(
                 'Name of output file containing \'contaminating\' unique '
                 'sequences which are to be substituted with original IDs.'
@@ -114,7 +94,7 @@ arg_parser.add_argument(
         default=None
         )
 arg_parser.add_argument(
-        'dict_file', type=str,
+        'dict_file', type=str, nargs='?',
         help=(
                 'Name of dictionary file (from Fasta2Phylip.py) containing '
                 'dictionary of unique and original identities.'
@@ -130,26 +110,41 @@ arg_parser.add_argument(
                 ),
         action='store_true'
         )
+arg_parser.add_argument(
+        '-j', '--jobs', type=int,
+        help=(
+                'Number of files to run at once in batch mode; 0 utilizes '
+                'every core.'
+                ),
+        default=1
+        )
 args = arg_parser.parse_args()
 # }}}
 
 
+# {{{ Run
+def run(fasta_file, rem_file):
+    fas = FastaFile(fasta_file, rem_file)
+    fas.write_new_output(fas.remove_cont())
+# }}}
+
+
 # {{{ Batch
 if args.batch:
     cwd = getcwd()
     fid = listdir(cwd)
     # TODO: What sort of files am I working with here?
-    fasta_files = sorted([x for x in fid if '.fasta' in x])
-    rem_files = sorted([x for x in fid if '.txt' in x])
-    for i, j in zip(fasta_files, rem_files):
-        FastaFile(i, j)
+    # Exclude output of previous runs
+    fasta_files = [
+            x for x in fid if '.fasta' in x and '_new.fasta' not in x
+            ]
+    rem_files = [x for x in fid if '.txt' in x]
+    run_batch(run, pair_files(fasta_files, rem_files), args.jobs)
 else:
-    FastaFile(args.fasta_file, args.rem_file)
-# }}}
-
-
-# {{{ Run
-for fas in FastaFile:
-    fas.remove_cont()
-    fas.write_new_fasta()
+    if not args.cont_file or not args.dict_file:
+        exit(
+                'You did not specify a fasta/dictionary file to run nor did '
+                'you run the script in batch mode. Try again.'
+                )
+    run(args.cont_file, args.dict_file)
 # }}}
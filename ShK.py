@@ -14,9 +14,25 @@
 
 # {{{ Imports
 from os import getcwd, listdir
-import re
+from os.path import splitext
+from collections import OrderedDict, Counter
+from itertools import islice, imap
+from hashlib import sha1
+from multiprocessing import Pool, cpu_count
 import argparse
-from sys import exit
+from sys import exit, stdout
+from FastaIO import read_fasta, join_header
+from CysScan import CysFramework, MotifLibrary, REJECT_STAGES
+from Batch import run_batch
+# }}}
+
+
+# {{{ Globals
+# ::MODIFIABLE::
+# Number of unique sequences scanned by a worker process at a time when
+# running with more than one job, and the number of such chunks queued per job
+CHUNK_SIZE = 2000
+CHUNKS_PER_JOB = 4
 # }}}
 
 
@@ -29,32 +45,23 @@ class PepFile(object):
 
     }}} """
 
-    # {{{ read_pep_into_dict
-    def read_pep_into_dict(self, pep_file):
+    # {{{ read_pep_records
+    def read_pep_records(self, pep_file):
 
         """ {{{ Docstrings
 
-        Reads the pep file into a dictionary in the format of:
+        Lazily reads the pep file, yielding one tuple per record in the format
+        of:
 
-            dictionary = {
+            ('Pep_ID', 'Pep_seq')
 
-                    'Pep_ID' : 'Pep_seq'
-
-                    }
+        Where Pep_ID is the full header line, including the greater than (">")
+        symbol. Only a single record is held in memory at any one time.
 
         }}} """
 
-        # Read in pep file
-        with open(pep_file, 'r') as pep:
-                pep = pep.readlines()
-        # Filter out IDs and strip each entry of leading/trailing whitespace
-        Pep_IDs = [line.strip() for line in pep if line[0] == '>']
-        # Filter out peptide sequences and strip each entry of
-        # leading/trailing whitespace
-        Pep_seqs = [line.strip() for line in pep if line[0] != '>']
-        # Concatenate into dictionary
-        pep_dict = dict(zip(Pep_IDs, Pep_seqs))
-        return pep_dict
+        for seq_ID, description, Pep_seq in read_fasta(pep_file):
+            yield('>' + join_header(seq_ID, description), Pep_seq)
     # }}}
 
     # {{{ write_pep_dict_to_file
@@ -62,29 +69,56 @@ class PepFile(object):
 
         """ {{{ Docstrings
 
-        Writes the filtered pep dict into a pep file with the format of:
+        Writes the filtered pep dict into a pep file, one record per domain,
+        with the format of:
+
+            '>Pep_ID Motif:start-end\n'
+            'Pep_seq\n'
+
+        Where Motif is the name of the framework matched (e.g. ShK) and start
+        and end are the one-based, inclusive coordinates of the domain within
+        the original peptide sequence. When scanning nucleotide sequences,
+        the format is instead:
 
-            '>Pep_ID\n'
+            '>Seq_ID frame:+1 Motif:start-end(+)\n'
             'Pep_seq\n'
 
+        Where start and end are nucleotide coordinates (see
+        Translate.frame_coordinates). If a PSSM was specified, the score of
+        each domain follows (see score_results).
+
         }}} """
 
         # Open filtered pep file in write mode
         with open(self._filtered_pep_file, 'w') as pep_file:
             for k, v in self._filtered_pep_dict.iteritems():
-                # Set values for readability
-                Pep_ID = k
-                # Handle addition of newline character in manner contingent
-                # upon length; improve readability when writing
-                # If only one match returned, append newline "\n" character
-                if len(v) == 1:
-                    Pep_seq = v[0] + '\n'
-                # Else, join each item in list with newline character
-                else:
-                    Pep_seq = '\n'.join(v)
-                # Write to file
-                pep_file.write(Pep_ID)
-                pep_file.write(Pep_seq)
+                # Write each match as its own record
+                for label, Pep_seq in v:
+                    pep_file.write('{0} {1}\n{2}\n'.format(k, label, Pep_seq))
+    # }}}
+
+    # {{{ write_members_file
+    def write_members_file(self):
+
+        """ {{{ Docstrings
+
+        Writes the membership of each group of identical filtered sequences
+        to a tab-delimited file with the format of:
+
+            'Representative_Pep_ID\tPep_ID\n'
+
+        With one line per Pep_ID, each of which is truncated at the first
+        whitespace character (i.e. sans description).
+
+        }}} """
+
+        with open(self._members_file, 'w') as members:
+            members.write('representative_id\tpep_id\n')
+            for k, v in self._members.iteritems():
+                for Pep_ID in v:
+                    members.write('{0}\t{1}\n'.format(
+                            k[1:].split()[0], Pep_ID[1:].split()[0]
+                            ))
     # }}}
 # }}}
 
@@ -94,88 +128,346 @@ class SearchParse(PepFile):
 
     """ {{{ Docstrings
 
-    A class in which all regular expression searching and subsequent data
-    parsing is stored.
+    A class in which all domain searching and subsequent data parsing is
+    stored.
 
     }}} """
 
-    # {{{ search_the_6_Cs (Arr, matey)
-    def search_the_6_Cs(self, pep_seq):
+    # {{{ ShK_domain
+    # "(m, n)" means "between m and n residues (of any kind, including
+    # cysteine) separate the two cysteines", while an n of None means "m or
+    # more residues"; i.e. C[...]+C[...]+C[...]{1,50}C[...]{3}C[...]{2}C
+    # ::MODIFIABLE::
+    # NOTE: If you would like to search further upstream for preceding
+    # cysteines, simply modify the 50 in (1, 50)
+    ShK_domain = CysFramework(
+            'ShK', ((1, None), (1, None), (1, 50), (3, 3), (2, 2))
+            )
+    # Library of frameworks searched for; replaced by the contents of the
+    # motif definition file if one is specified (see -m/--motifs)
+    motifs = MotifLibrary([ShK_domain])
+    # Whether the sequences are nucleotide sequences, to be translated in all
+    # six frames (see -n/--nucleotide)
+    nucleotide = False
+    # Position-specific scoring matrix with which domains are scored and the
+    # minimum score of those domains kept (see -p/--pssm and --min_score)
+    pssm = None
+    min_score = None
+    # }}}
+
+    # {{{ frames
+    def frames(self, seq):
+
+        """ {{{ Docstrings
+
+        Returns a list of the peptide sequences to be searched for a given
+        sequence, in the form of:
+
+            [(frame, 'peptide')]
+
+        i.e. the six-frame translation of a nucleotide sequence (see
+        Translate.six_frame_translate) or the peptide sequence itself, with a
+        frame of None.
+
+        }}} """
+
+        if self.nucleotide:
+            # Imported here such that numpy is only required when scanning
+            # nucleotide sequences
+            from Translate import six_frame_translate
+            return six_frame_translate(seq)
+        return [(None, seq)]
+    # }}}
+
+    # {{{ label
+    @staticmethod
+    def label(motif, frame, length, start, end):
 
         """ {{{ Docstrings
 
-        Utilizing regular expressions (as provided by the "re" python module),
-        searches a peptide sequence for occurrences of the ShK domain as
-        defined below.
+        Formats the location of a domain for writing, given the zero-based,
+        end exclusive, coordinates of the domain within the peptide sequence
+        searched, and if applicable, the frame of and length of the
+        nucleotide sequence from which it was translated.
 
         }}} """
 
-        # {{{ SearchPattern
-        # First, must define serach pattern
-        # All possible values in peptide sequence; a little bit more specific
-        # than "\w"
-        amino_acids = [
-                'A', 'R', 'N', 'D', 'C', 'Q', 'E', 'G', 'H', 'I', 'L', 'K',
-                'M', 'F', 'P', 'S', 'T', 'W', 'Y', 'V'
-                ]
-        # "|" in regular expression speak means "or"
-        amino_acids = '|'.join(amino_acids)
-        # In regular expression speak, "{m}" means "match exactly this number
-        # of the preceding expression", "+" means "match 1 or more repetitions
-        # of preceding expression", and {m,n} means "match m through n
-        # repetitions of preceding expression, attempting to match as many as
-        # possible"
-        # ::MODIFIABLE::
-        # NOTE: If you would like to search further upstream for preceding
-        # cysteines, simply modify second integer in {1,50}
-        ShK_domain = (
-                'C[' + amino_acids + ']+C[' + amino_acids + ']+C[' +
-                amino_acids + ']{1,50}C[' + amino_acids + ']{3}C[' +
-                amino_acids + ']{2}C'
+        if frame is None:
+            return '{0}:{1}-{2}'.format(motif, start + 1, end)
+        from Translate import frame_coordinates
+        return 'frame:{0:+d} {1}:{2}-{3}({4})'.format(
+                frame, motif, *frame_coordinates(frame, length, start, end)
                 )
-        # Compile into pattern re.findall can utilize
-        ShK_domain = re.compile(ShK_domain)
-        # }}}
+    # }}}
+
+    # {{{ search_the_6_Cs (Arr, matey)
+    def search_the_6_Cs(self, pep_seq):
+
+        """ {{{ Docstrings
+
+        Utilizing the cysteine framework scanner (as provided by CysScan.py),
+        searches a peptide sequence for occurrences of every framework in the
+        motif library (by default, only the ShK domain as defined above),
+        including overlapping occurrences.
+
+        }}} """
 
         # Does peptide sequence contain ShK domain?
-        putative_ShK_domains = re.findall(ShK_domain, pep_seq)
-        # If matches found, return list of all matches (as strings)
+        putative_ShK_domains = self.motifs.scan(pep_seq)
+        # If matches found, return list of all matches in the form of
+        # ('motif', start, end, 'domain'), where start and end are
+        # zero-based, end exclusive
         if putative_ShK_domains:
-            return putative_ShK_domains
+            return [
+                    (motif, start, end, pep_seq[start:end])
+                    for motif, start, end in putative_ShK_domains
+                    ]
         # Else, return false
         else:
             return False
     # }}}
 
+    # {{{ scan_records
+    def scan_records(self, records):
+
+        """ {{{ Docstrings
+
+        Utilizing previous function, search_the_6_Cs, scans a list of
+        (key, seq) records, each of which is searched in every frame (see
+        frames). Frames which cannot possibly contain the motifs (see
+        CysScan.MotifLibrary.reject) are rejected prior to the search. Returns
+        a tuple in the form of:
+
+            ([(key, [('label', 'domain')])], Counter)
+
+        Where the list contains, in input order, the result of the search for
+        every record (False if no motif was found; see label) and the Counter
+        tallies the number of frames rejected at each stage. If a PSSM was
+        specified, the domains of every record are then scored in a single
+        batch (see score_results).
+
+        }}} """
+
+        results = []
+        stats = Counter()
+        # Domain candidates in the form of ('peptide', start, end), in the
+        # order in which they occur in results
+        candidates = []
+        for key, seq in records:
+            stats['scanned'] += 1
+            domains = []
+            for frame, Pep_seq in self.frames(seq):
+                stats['frames'] += 1
+                # Pre-filter
+                stage = self.motifs.reject(Pep_seq)
+                if stage:
+                    stats[stage] += 1
+                    continue
+                hits = self.search_the_6_Cs(Pep_seq)
+                if not hits:
+                    stats['search'] += 1
+                    continue
+                for motif, start, end, domain in hits:
+                    domains.append((
+                            self.label(motif, frame, len(seq), start, end),
+                            domain
+                            ))
+                    candidates.append((Pep_seq, start, end))
+            results.append((key, domains))
+        if self.pssm is not None:
+            results = self.score_results(results, candidates, stats)
+        return([(key, domains or False) for key, domains in results], stats)
+    # }}}
+
+    # {{{ score_results
+    def score_results(self, results, candidates, stats):
+
+        """ {{{ Docstrings
+
+        Scores every domain candidate against the PSSM in a single batch (see
+        PSSM.score_spans), appending the score to the label of each domain in
+        the form of:
+
+            'label score:12.34'
+
+        And discarding those domains scoring below the minimum score, if
+        specified.
+
+        }}} """
+
+        scores = iter(self.pssm.score_spans(candidates))
+        scored = []
+        for key, domains in results:
+            kept = []
+            for label, domain in domains:
+                score = next(scores)
+                if self.min_score is not None and score < self.min_score:
+                    stats['score'] += 1
+                    continue
+                kept.append(('{0} score:{1:.2f}'.format(label, score), domain))
+            scored.append((key, kept))
+        return scored
+    # }}}
+
+    # {{{ format_filter_stats
+    def format_filter_stats(self, pep_file):
+
+        """ {{{ Docstrings
+
+        Returns a report of the number of records (or when scanning
+        nucleotide sequences, translated frames) rejected at each stage, one
+        line per stage.
+
+        }}} """
+
+        stats = self._filter_stats
+        unit = 'frames' if self.nucleotide else 'records'
+        lines = ['{0}: {1} records read.'.format(pep_file, stats['records'])]
+        lines.append(
+                '\tDeduplication: {0} identical to an earlier sequence, {1} '
+                'unique sequences scanned.'.format(
+                        stats['records'] - stats['scanned'], stats['scanned']
+                        )
+                )
+        if self.nucleotide:
+            lines.append('\tTranslation: {0} frames translated.'.format(
+                    stats['frames']
+                    ))
+        for stage, description in REJECT_STAGES:
+            lines.append('\tPre-filter ({0}): {1} {2} rejected.'.format(
+                    description, stats[stage], unit
+                    ))
+        lines.append('\tSearch (no motif): {0} {1} rejected.'.format(
+                stats['search'], unit
+                ))
+        if self.min_score is not None:
+            lines.append(
+                    '\tScoring (below minimum score): {0} domains '
+                    'rejected.'.format(stats['score'])
+                    )
+        lines.append('\t{0} records contain at least one motif.'.format(
+                stats['hits']
+                ))
+        return ''.join(i + '\n' for i in lines)
+    # }}}
+
     # {{{ filter_pep_dict
-    def filter_pep_dict(self):
+    def filter_pep_dict(self, jobs=1, collapse=False):
 
         """ {{{ Docstrings
 
-        Utilizing previous function, search_the_6_Cs, filters peptide
+        Utilizing previous function, scan_records, filters peptide
         sequences, only keeping those which return a TRUE value (i.e. contain
-        at least one occurrence the ShK domain).
+        at least one occurrence of any motif).
+
+        Identical sequences are grouped by their SHA-1 digest, such that each
+        unique sequence is only scanned once and the result is mapped back
+        to every Pep_ID which shares it. If collapse is TRUE, only the first
+        Pep_ID of each group is kept, and the membership of each group is
+        stored in self._members in the form of:
+
+            dictionary = {
+                    'Representative_Pep_ID' : ['Pep_ID', 'Pep_ID']
+                    }
+
+        If jobs is greater than 1, the unique sequences are split into chunks
+        which are scanned in that many worker processes. Results are merged
+        in input order, such that output is identical to that of serial mode.
 
         }}} """
 
         # Initialze empty dictionary where peptide sequences containing at
-        # at least one occurrence of the ShK domain will be stored
-        filtered_pep_dict = {}
-        # Itereate over keys, values in pep_dict
-        for k, v in self._pep_dict.iteritems():
-            # Set values for readability
-            Pep_ID = k
-            Pep_seq = self.search_the_6_Cs(v)
-            # If it contains the ShK domain, include it in filtered pep dict,
-            # else, discard
-            if Pep_seq:
-                filtered_pep_dict[Pep_ID] = Pep_seq
+        # at least one occurrence of any motif will be stored, in the order in
+        # which they occur in the pep file
+        filtered_pep_dict = OrderedDict()
+        self._filter_stats = Counter()
+        self._members = OrderedDict()
+        # Result of the search for each unique sequence, keyed by digest
+        cache = {}
+        # Representative Pep_ID of each unique sequence, keyed by digest
+        representatives = {}
+        records = iter(self._pep_records)
+        pool = Pool(jobs) if jobs > 1 else None
+        try:
+            while True:
+                # Only read a bounded number of records at a time, such that
+                # the pep file is not read into memory in its entirety
+                pending = []
+                unique = OrderedDict()
+                for Pep_ID, Pep_seq in islice(
+                        records, CHUNK_SIZE * CHUNKS_PER_JOB * max(jobs, 1)
+                        ):
+                    key = sha1(Pep_seq).digest()
+                    pending.append((Pep_ID, key))
+                    if key not in cache and key not in unique:
+                        unique[key] = Pep_seq
+                if not pending:
+                    break
+                chunks = chunk_records(unique.iteritems(), CHUNK_SIZE)
+                # Pool.imap returns results in the order submitted
+                if pool:
+                    chunks = pool.imap(scan_chunk, chunks)
+                else:
+                    chunks = imap(scan_chunk, chunks)
+                for results, stats in chunks:
+                    cache.update(results)
+                    self._filter_stats.update(stats)
+                # Map results back to every Pep_ID, in input order
+                for Pep_ID, key in pending:
+                    self._filter_stats['records'] += 1
+                    if not cache[key]:
+                        continue
+                    self._filter_stats['hits'] += 1
+                    if not collapse:
+                        filtered_pep_dict[Pep_ID] = cache[key]
+                    elif key in representatives:
+                        self._members[representatives[key]].append(Pep_ID)
+                    else:
+                        representatives[key] = Pep_ID
+                        self._members[Pep_ID] = [Pep_ID]
+                        filtered_pep_dict[Pep_ID] = cache[key]
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
         # Return filtered_pep_dict
         return filtered_pep_dict
     # }}}
 # }}}
 
 
+# {{{ chunk_records
+def chunk_records(records, chunk_size):
+
+    """ {{{ Docstrings
+
+    Generator which groups records into lists of at most chunk_size records.
+
+    }}} """
+
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+# }}}
+
+
+# {{{ scan_chunk
+def scan_chunk(chunk):
+
+    """ {{{ Docstrings
+
+    Scans a chunk of records in a worker process. Defined at module level such
+    that it may be pickled by multiprocessing.
+
+    }}} """
+
+    return SearchParse().scan_records(chunk)
+# }}}
+
+
 # {{{ Data
 class Data(SearchParse):
 
@@ -187,15 +479,36 @@ class Data(SearchParse):
     }}} """
 
     # {{{ __init__
-    def __init__(self, pep_file):
-        self._pep_dict = self.read_pep_into_dict(pep_file)
-        self._filtered_pep_dict = self.filter_pep_dict()
-        self._filtered_pep_file = pep_file.replace('.pep', '_filtered.pep')
+    def __init__(self, pep_file, jobs=1, collapse=False):
+        self._pep_records = self.read_pep_records(pep_file)
+        self._filtered_pep_dict = self.filter_pep_dict(jobs, collapse)
+        root, ext = splitext(pep_file)
+        self._filtered_pep_file = root + '_filtered' + ext
+        self._members_file = root + '_members.txt'
         self.write_pep_dict_to_file()
+        if collapse:
+            self.write_members_file()
+        self.filter_stats = self.format_filter_stats(pep_file)
     # }}}
 # }}}
 
 
+# {{{ filter_pep_file
+def filter_pep_file(pep_file, jobs=1, collapse=False):
+
+    """ {{{ Docstrings
+
+    Filters a pep file (see Data), returning the report of the number of
+    records rejected at each stage (see format_filter_stats) rather than
+    printing it, such that, in batch mode, the reports of files filtered at
+    once are printed by the parent process, one file after another.
+
+    }}} """
+
+    return Data(pep_file, jobs, collapse).filter_stats
+# }}}
+
+
 # {{{ Main argument parser
 arg_parser = argparse.ArgumentParser(
         prog='ShK.py',
@@ -232,7 +545,77 @@ arg_parser.add_argument(
                 ),
         action='store_true'
         )
+arg_parser.add_argument(
+        '-j', '--jobs', type=int,
+        help=(
+                'Number of worker processes with which to scan each pep file '
+                '(or, in batch mode with more than one pep file, to scan pep '
+                'files at once). Specify 0 to utilize all available cores.'
+                ),
+        default=1
+        )
+arg_parser.add_argument(
+        '-m', '--motifs', type=str,
+        help=(
+                'Name of motif definition file listing the cysteine '
+                'frameworks to search for (e.g. Cys_Frameworks.txt). Every '
+                'framework is searched for in a single pass and each hit is '
+                'tagged with the framework it matched. If not specified, '
+                'only the ShK domain is searched for.'
+                ),
+        default=None
+        )
+arg_parser.add_argument(
+        '-c', '--collapse',
+        help=(
+                'Collapse identical sequences, writing only the first Pep_ID '
+                'of each to the filtered pep file and the membership of each '
+                'group to a "_members.txt" file.'
+                ),
+        action='store_true'
+        )
+arg_parser.add_argument(
+        '-n', '--nucleotide',
+        help=(
+                'Input files contain nucleotide, rather than peptide, '
+                'sequences (e.g. a transcriptome assembly), each of which is '
+                'translated and searched in all six frames. Requires numpy. '
+                'In batch mode, every fasta file in directory is run.'
+                ),
+        action='store_true'
+        )
+arg_parser.add_argument(
+        '-p', '--pssm', type=str,
+        help=(
+                'Name of position-specific scoring matrix file (e.g. the '
+                'SMART SM00254 profile, or an ASCII PSSM output by '
+                'PSI-BLAST) with which every domain is scored. The score is '
+                'written next to each domain. Requires numpy.'
+                ),
+        default=None
+        )
+arg_parser.add_argument(
+        '--min_score', type=float,
+        help=(
+                'Discard domains scoring below this value. Requires '
+                '-p/--pssm.'
+                ),
+        default=None
+        )
 args = arg_parser.parse_args()
+if args.min_score is not None and not args.pssm:
+    exit('You specified a minimum score without a PSSM. Try again.')
+if args.jobs <= 0:
+    args.jobs = cpu_count()
+# Load motif library prior to forking any worker processes
+if args.motifs:
+    SearchParse.motifs = MotifLibrary.read_motif_file(args.motifs)
+SearchParse.nucleotide = args.nucleotide
+if args.pssm:
+    # Imported here such that numpy is only required when scoring
+    from PSSM import PSSM
+    SearchParse.pssm = PSSM.read_pssm_file(args.pssm)
+    SearchParse.min_score = args.min_score
 # }}}
 
 
@@ -248,10 +631,23 @@ if args.batch:
     # NOTE: All files you wish to run should contain the string '.pep' in the
     # name and all files containing this string will be run if you specify
     # the batch flag
-    pep_files = [x for x in files if '.pep' in x]
-    # Instantiate intances of Data class for all pep files found
-    for i in pep_files:
-        Data(i)
+    # NOTE: If running with the nucleotide flag, all files containing the
+    # string '.fasta' in the name will be run instead
+    ext = '.fasta' if args.nucleotide else '.pep'
+    pep_files = sorted(
+            x for x in files if ext in x and '_filtered' not in x
+            )
+    # Instantiate intances of Data class for all pep files found, scanning
+    # up to jobs files at once rather than chunks of a single file, and
+    # print the report of each in file order
+    if len(pep_files) > 1:
+        run_batch(
+                filter_pep_file, [(i, 1, args.collapse) for i in pep_files],
+                args.jobs, report=stdout.write
+                )
+    else:
+        for i in pep_files:
+            stdout.write(filter_pep_file(i, args.jobs, args.collapse))
 # Else, utilize user-specified string to instantiate single instance of Data
 # class
 else:
@@ -262,5 +658,5 @@ else:
                 'script in batch mode. Try again.'
                 )
     # Else, continue
-    Data(args.pep_file)
+    stdout.write(filter_pep_file(args.pep_file, args.jobs, args.collapse))
 # }}}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+# {{{ Header
+# Code written by: Edwin Rice
+# email: edwinricethe4th@gmail.com
+# phone: +1 (513) 426-4187
+# github: https://github.com/EdRice4
+#
+# Vectorized six-frame translation utilized by ShK.py. Requires numpy.
+# }}}
+
+
+# {{{ Imports
+import numpy as np
+# }}}
+
+
+# {{{ Globals
+# Standard genetic code, with codons in TCAG order, i.e. TTT, TTC, TTA, TTG,
+# TCT, ...
+GENETIC_CODE = (
+        'FFLLSSSSYY**CC*WLLLLPPPPHHQQRRRRIIIMTTTTNNKKSSRRVVVVAAAADDEEGGGG'
+        )
+# Byte-level lookup table encoding each nucleotide as T/U = 0, C = 1, A = 2,
+# G = 3 and any other character (e.g. N) as 4
+ENCODE = np.full(256, 4, dtype=np.uint8)
+for i, j in enumerate('TCAG'):
+    ENCODE[ord(j)] = ENCODE[ord(j.lower())] = i
+ENCODE[ord('U')] = ENCODE[ord('u')] = 0
+# Complement of each encoded nucleotide
+COMPLEMENT = np.array([2, 3, 0, 1, 4], dtype=np.uint8)
+# Amino acid corresponding to each encoded codon, 25 * first + 5 * second +
+# third; codons containing an ambiguous nucleotide are translated as X
+CODONS = np.full(125, ord('X'), dtype=np.uint8)
+for i in range(4):
+    for j in range(4):
+        for k in range(4):
+            CODONS[25 * i + 5 * j + k] = ord(GENETIC_CODE[16 * i + 4 * j + k])
+# }}}
+
+
+# {{{ six_frame_translate
+def six_frame_translate(seq):
+
+    """ {{{ Docstrings
+
+    Translates a nucleotide sequence in all six reading frames, returning a
+    list of tuples in the form of:
+
+        [(frame, 'peptide'), (frame, 'peptide')]
+
+    Where frame is one of +1, +2, +3 (forward strand, beginning at the first,
+    second or third nucleotide) or -1, -2, -3 (likewise, but of the reverse
+    complement). Stop codons are translated as "*". Every codon of the
+    sequence is translated at once via the lookup tables above, rather than
+    one codon at a time.
+
+    }}} """
+
+    codes = ENCODE[np.frombuffer(seq, dtype=np.uint8)]
+    frames = []
+    for strand, strand_codes in ((1, codes), (-1, COMPLEMENT[codes[::-1]])):
+        # Encoded codon beginning at every position
+        codons = (
+                strand_codes[:-2].astype(np.intp) * 25 +
+                strand_codes[1:-1] * 5 + strand_codes[2:]
+                )
+        for offset in range(3):
+            frames.append((
+                    strand * (offset + 1),
+                    CODONS[codons[offset::3]].tobytes()
+                    ))
+    return frames
+# }}}
+
+
+# {{{ frame_coordinates
+def frame_coordinates(frame, length, start, end):
+
+    """ {{{ Docstrings
+
+    Converts the zero-based, end exclusive, coordinates of a peptide
+    translated in the given frame of a nucleotide sequence of the given
+    length into one-based, inclusive, nucleotide coordinates in the form of:
+
+        (start, end, 'strand')
+
+    As with TransDecoder, start is greater than end on the reverse strand.
+
+    }}} """
+
+    offset = abs(frame) - 1
+    if frame > 0:
+        return(offset + 3 * start + 1, offset + 3 * end, '+')
+    return(length - offset - 3 * start, length - offset - 3 * end + 1, '-')
+# }}}